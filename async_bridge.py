@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from PySide6 import QtCore
+
+
+class AsyncioBridge(QtCore.QObject):
+    '''
+    在一個執行緒執行 asyncio event loop, 與 Qt event loop 並行
+    所有 AsyncSerialPort 共用這個 loop, 完成的結果以 signal 回到建立 bridge 的執行緒
+    '''
+    send_log = QtCore.Signal(str)
+    completed = QtCore.Signal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # add_reader 需要 selector event loop
+        self.loop = asyncio.SelectorEventLoop()
+        self.thread = threading.Thread(target=self.run, name='asyncio-bridge', daemon=True)
+        self.completed.connect(self.deliver)
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine, callback=None):
+        '''
+        由 Qt 執行緒送出 coroutine, 回傳 concurrent.futures.Future
+        callback(future) 會在 bridge 所在的執行緒執行
+        '''
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if callback is not None:
+            # done callback 在 asyncio 執行緒執行, 經由 queued signal 轉回 Qt 執行緒
+            future.add_done_callback(lambda done: self.completed.emit((done, callback)))
+        return future
+
+    def call_soon(self, function, *args):
+        self.loop.call_soon_threadsafe(function, *args)
+
+    @QtCore.Slot(object)
+    def deliver(self, item):
+        future, callback = item
+        try:
+            callback(future)
+        except Exception as error:
+            self.send_log.emit(f'callback error: {error!r}')
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
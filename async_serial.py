@@ -0,0 +1,146 @@
+import asyncio
+import collections
+
+import serial
+
+from command import encode_line
+from response import ResponseKind, classify
+from traffic_capture import RecordingSerial
+
+
+class FirmwareError(Exception):
+    '''
+    韌體以 error 回應指令
+    '''
+
+
+class PendingCommand(object):
+    def __init__(self, future):
+        self.future = future
+        self.lines = []
+
+
+class AsyncSerialPort(object):
+    '''
+    以 loop.add_reader 監聽 serial fd 的 asyncio transport
+    同一個 event loop 可以同時服務多個 port, 只支援有 fd 的平台 (posix)
+    '''
+
+    def __init__(self, port: str, baudrate: int = 115200, window: int = 1, recorder=None):
+        self.port = port
+        self.baudrate = baudrate
+        # TrafficRecorder, 紀錄所有讀寫
+        self.recorder = recorder
+        # 同時送出但尚未收到 FlowDone 的指令數量上限
+        self.window = window
+        self.serial = None
+        self.loop = None
+        self.slots = None
+        self.buffer = bytearray()
+        # 依送出順序等待 FlowDone 與 suspend 回應的指令
+        self.pending = collections.deque()
+        self.pending_suspend = collections.deque()
+        self.on_unsolicited = None
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.window)
+        # timeout=0: read 不會阻塞 event loop
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=0)
+        if self.recorder is not None:
+            self.serial = RecordingSerial(self.serial, self.recorder)
+        self.loop.add_reader(self.serial.fileno(), self.on_readable)
+        return self
+
+    def close(self):
+        if self.serial is None:
+            return
+        self.loop.remove_reader(self.serial.fileno())
+        self.serial.close()
+        self.serial = None
+        error = ConnectionError(f'{self.port} closed')
+        for pending in list(self.pending) + list(self.pending_suspend):
+            if not pending.future.done():
+                pending.future.set_exception(error)
+        self.pending.clear()
+        self.pending_suspend.clear()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def check_open(self):
+        if self.serial is None:
+            raise ConnectionError(f'{self.port} is not open')
+
+    async def send(self, command) -> list:
+        '''
+        送出指令並等待 FlowDone, 回傳收到的所有回應行
+        '''
+        if isinstance(command, str):
+            command = encode_line(command)
+        self.check_open()
+        async with self.slots:
+            # 等待 window 時 port 可能已被關閉
+            self.check_open()
+            pending = PendingCommand(self.loop.create_future())
+            self.pending.append(pending)
+            self.serial.write(command)
+            return await pending.future
+
+    async def send_emergency(self, command) -> list:
+        '''
+        suspend[n] 不佔用 window, 等待 suspend 回應
+        '''
+        if isinstance(command, str):
+            command = encode_line(command)
+        self.check_open()
+        pending = PendingCommand(self.loop.create_future())
+        self.pending_suspend.append(pending)
+        self.serial.write(command)
+        return await pending.future
+
+    def on_readable(self):
+        try:
+            self.buffer += self.serial.read(self.serial.in_waiting or 1)
+        except OSError:
+            # 拔除或斷線時 in_waiting 會丟出 OSError (EIO), SerialException 也是 OSError
+            # 必須移除 reader 並讓等待中的指令失敗, 否則每一輪 event loop 都會再次觸發
+            self.close()
+            return
+
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end < 0:
+                break
+            self.dispatch(bytes(self.buffer[start:end + 1]))
+            start = end + 1
+        del self.buffer[:start]
+
+    def dispatch(self, line: bytes):
+        response = classify(line)
+        if response.kind == ResponseKind.SUSPEND and self.pending_suspend:
+            pending = self.pending_suspend.popleft()
+            pending.lines.append(line)
+            pending.future.set_result(pending.lines)
+            return
+
+        if len(self.pending) == 0:
+            if self.on_unsolicited:
+                self.on_unsolicited(line)
+            return
+
+        # 韌體依序執行, 回應一定屬於最早送出的指令
+        pending = self.pending[0]
+        pending.lines.append(line)
+        if response.kind == ResponseKind.FLOW_DONE:
+            self.pending.popleft()
+            if not pending.future.done():
+                pending.future.set_result(pending.lines)
+        elif response.kind == ResponseKind.ERROR:
+            self.pending.popleft()
+            if not pending.future.done():
+                pending.future.set_exception(FirmwareError(line))
@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import time
+import signal
+import resource
+import argparse
+import subprocess
+
+from PySide6 import QtCore
+from command import encode_line
+from response import classify
+from framing import FrameDecoder, encode_line_frame
+
+
+MOVE_COMMAND = 'MoveStnX\t{}\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx'
+
+BAUD_RATE = 115200
+'''
+8N1 每個 byte 佔 10 bit
+'''
+
+
+class ThreadEngine(QtCore.QObject):
+    '''
+    only_read_write / priority_queue: QThread 內的 pyserial 迴圈
+    '''
+
+    def __init__(self, module):
+        super().__init__()
+        self.worker = module.CommandWorker()
+        self.worker.received.connect(self.complete)
+        self.completed = 0
+        self.on_complete = None
+
+    def open(self, port: str):
+        self.worker.open_uart(port)
+        self.worker.start()
+
+    def submit(self, command_list: list):
+        for command in command_list:
+            self.worker.set_command(command)
+
+    @QtCore.Slot()
+    def complete(self):
+        self.completed += 1
+        if self.on_complete:
+            self.on_complete()
+
+
+class FlowEngine(QtCore.QObject):
+    '''
+    three_thread: QSerialPort 與 FlowWorker
+    '''
+
+    def __init__(self):
+        super().__init__()
+        from port_manager import PortSession
+        self.thread = QtCore.QThread()
+        self.thread.start()
+        self.session = None
+        self.session_class = PortSession
+        self.completed = 0
+        self.on_complete = None
+
+    def open(self, port: str):
+        self.session = self.session_class(port)
+        self.session.moveToThread(self.thread)
+        self.session.flow_worker.step_done.connect(self.complete)
+        self.session.open_requested.emit(port)
+
+    def submit(self, command_list: list):
+        self.session.flow_requested.emit(command_list)
+
+    @QtCore.Slot(int)
+    def complete(self, sequence: int):
+        self.completed += 1
+        if self.on_complete:
+            self.on_complete()
+
+
+def create_engine(name: str):
+    if name == 'three_thread':
+        return FlowEngine()
+    if name == 'only_read_write':
+        import only_read_write
+        return ThreadEngine(only_read_write)
+    if name == 'priority_queue':
+        import priority_queue
+        return ThreadEngine(priority_queue)
+    raise ValueError(f'unknown engine: {name}')
+
+
+ENGINES = ['only_read_write', 'priority_queue', 'three_thread']
+
+
+def run_event_loop(seconds: float, engine=None, target: int = 0):
+    '''
+    執行 event loop 直到 engine 完成 target 筆指令或超過時間
+    '''
+    loop = QtCore.QEventLoop()
+    timer = QtCore.QTimer()
+    timer.setSingleShot(True)
+    timer.timeout.connect(loop.quit)
+    timer.start(int(seconds * 1000))
+
+    if engine is not None:
+        if engine.completed >= target:
+            return True
+
+        def check():
+            if engine.completed >= target:
+                loop.quit()
+        engine.on_complete = check
+
+    loop.exec()
+    if engine is not None:
+        engine.on_complete = None
+        return engine.completed >= target
+    return True
+
+
+def percentile(values: list, q: float):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def start_simulator(args):
+    '''
+    模擬器在獨立的 process 執行, CPU, RSS 與 GIL 都不與 engine 共用
+    回傳 (process, port)
+    '''
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simulator.py'),
+            '--latency', str(args.latency),
+            '--jitter', str(args.jitter),
+            '--flow-time', str(args.flow_time),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # 模擬器啟動後第一行輸出 pty 的路徑
+    port = process.stdout.readline().strip()
+    if not port:
+        process.kill()
+        process.wait()
+        raise RuntimeError('simulator did not start')
+    return process, port
+
+
+def stop_simulator(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def benchmark_engine(name: str, args):
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication(sys.argv)
+
+    simulator, port = start_simulator(args)
+
+    engine = create_engine(name)
+    engine.open(port)
+
+    # 開啟 port 後不送指令, 量測閒置時的 CPU 使用率
+    run_event_loop(0.2)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    run_event_loop(args.idle)
+    idle_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+
+    # 逐筆送出, 量測單一指令的來回時間
+    latencies = []
+    for i in range(args.samples):
+        start = time.perf_counter()
+        engine.submit([MOVE_COMMAND.format(i)])
+        if not run_event_loop(args.timeout, engine, engine.completed + 1):
+            break
+        latencies.append(time.perf_counter() - start)
+
+    # 一次送出整個 flow, 量測吞吐量
+    command_list = [MOVE_COMMAND.format(i) for i in range(args.commands)]
+    target = engine.completed + len(command_list)
+    start = time.perf_counter()
+    engine.submit(command_list)
+    finished = run_event_loop(args.timeout, engine, target)
+    elapsed = time.perf_counter() - start
+    done = len(command_list) - (target - engine.completed)
+
+    result = {
+        'engine': name,
+        'commands': len(command_list),
+        'completed': done,
+        'finished': finished,
+        'commands_per_sec': done / elapsed,
+        'latency_p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'latency_p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'idle_cpu': idle_cpu,
+        # 只有 engine 的 process, Linux 的 ru_maxrss 單位為 KB
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    stop_simulator(simulator)
+    return result
+
+
+def benchmark_codec(count: int):
+    '''
+    比較文字與 binary frame 的編碼, 解碼時間與每筆指令的傳輸量
+    不使用快取, 量測的是每次實際編碼的成本
+    '''
+    lines = [MOVE_COMMAND.format(i).encode('utf8') for i in range(count)]
+    text_response = b'ack\r\nFlowDone\r\n'
+    results = []
+    for mode in ('text', 'binary'):
+        if mode == 'text':
+            encode = encode_line.__wrapped__
+            start = time.perf_counter()
+            encoded = [encode(line.decode('utf8')) for line in lines]
+            encode_time = time.perf_counter() - start
+            stream = text_response * count
+            start = time.perf_counter()
+            responses = [classify(line) for line in stream.splitlines(keepends=True)]
+            decode_time = time.perf_counter() - start
+            response_bytes = len(text_response)
+        else:
+            encode = encode_line_frame.__wrapped__
+            start = time.perf_counter()
+            encoded = [encode(line) for line in lines]
+            encode_time = time.perf_counter() - start
+            frame_response = encode(b'ack') + encode(b'FlowDone')
+            stream = frame_response * count
+            start = time.perf_counter()
+            responses = FrameDecoder().feed_responses(stream)
+            decode_time = time.perf_counter() - start
+            response_bytes = len(frame_response)
+
+        command_bytes = sum(len(command) for command in encoded) / count
+        round_bytes = command_bytes + response_bytes
+        results.append({
+            'codec': mode,
+            'commands': count,
+            'responses': len(responses),
+            'command_bytes': command_bytes,
+            'response_bytes': response_bytes,
+            'encode_us': encode_time / count * 1e6,
+            'decode_us': decode_time / len(responses) * 1e6,
+            # 只考慮傳輸時間時, 鏈路每秒可以完成的指令數
+            'link_commands_per_sec': BAUD_RATE / 10 / round_bytes,
+        })
+    return results
+
+
+def run_all(args):
+    '''
+    每個 engine 在獨立的 process 執行, 避免互相影響 CPU 與 RSS
+    '''
+    options = [
+        '--commands', str(args.commands),
+        '--samples', str(args.samples),
+        '--idle', str(args.idle),
+        '--latency', str(args.latency),
+        '--jitter', str(args.jitter),
+        '--flow-time', str(args.flow_time),
+        '--timeout', str(args.timeout),
+    ]
+    results = []
+    for name in args.engines:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', name] + options,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        lines = process.stdout.strip().splitlines()
+        if process.returncode != 0 or len(lines) == 0:
+            results.append({'engine': name, 'error': process.returncode})
+            continue
+        results.append(json.loads(lines[-1]))
+
+    with open(args.output, 'w', encoding='utf8') as output:
+        json.dump({'time': time.time(), 'results': results}, output, indent=2)
+
+    for result in results:
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark CommandWorker engines against the pty simulator')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES)
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--idle', type=float, default=1.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--flow-time', type=float, default=0.001)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--codec', action='store_true', help='only compare text and binary framing')
+    parser.add_argument('--child', choices=ENGINES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.codec:
+        for result in benchmark_codec(args.commands * 100):
+            print(json.dumps(result), flush=True)
+        sys.exit(0)
+
+    if args.child:
+        print(json.dumps(benchmark_engine(args.child, args)), flush=True)
+        # worker 執行緒是無窮迴圈, 直接結束 process
+        os._exit(0)
+
+    run_all(args)
@@ -0,0 +1,89 @@
+import os
+import time
+import struct
+
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+'''
+腳本的 checkpoint 路徑為腳本路徑加上此後綴
+'''
+
+MAGIC = b'QTCKPT1\0'
+HEADER = struct.Struct('<8sQ')
+'''
+magic, 腳本的 total (FileFlowSource 為檔案大小), 用來判斷腳本是否被修改
+'''
+RECORD = struct.Struct('<QQ')
+'''
+已完成的步驟數, 完成後 FlowSource 的 position
+'''
+
+
+class CheckpointJournal(object):
+    '''
+    append-only 紀錄 flow 已完成的步驟
+    每 sync_every 筆或 sync_interval 秒才 fsync 一次
+    resume 為 False 時清除既有的紀錄
+    '''
+
+    def __init__(self, path: str, total: int, resume: bool = False,
+                 sync_every: int = 32, sync_interval: float = 1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+        if not resume or self.load(path, total) is None:
+            # 沒有紀錄或腳本已經改變, 重新開始
+            with open(path, 'wb') as journal:
+                journal.write(HEADER.pack(MAGIC, total))
+        self.file = open(path, 'r+b')
+        # 捨棄中斷時只寫了一半的紀錄
+        size = os.fstat(self.file.fileno()).st_size
+        self.file.truncate(size - (size - HEADER.size) % RECORD.size)
+        self.file.seek(0, os.SEEK_END)
+
+    @staticmethod
+    def load(path: str, total: int):
+        '''
+        讀取最後一筆紀錄, 回傳 (step, position)
+        沒有紀錄時回傳 (0, 0), 檔案不存在或不符合時回傳 None
+        只讀取 header 與最後一筆, 與紀錄數量無關
+        '''
+        try:
+            journal = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with journal:
+            header = journal.read(HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, total):
+                return None
+            size = os.fstat(journal.fileno()).st_size
+            # 最後一筆可能因為中斷只寫了一半
+            count = (size - HEADER.size) // RECORD.size
+            if count == 0:
+                return 0, 0
+            journal.seek(HEADER.size + (count - 1) * RECORD.size)
+            return RECORD.unpack(journal.read(RECORD.size))
+
+    def append(self, step: int, position: int):
+        self.file.write(RECORD.pack(step, position))
+        self.pending += 1
+        if self.pending >= self.sync_every or \
+                time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self, remove: bool = False):
+        if self.file.closed:
+            return
+        self.sync()
+        self.file.close()
+        if remove:
+            os.remove(self.path)
@@ -0,0 +1,97 @@
+import threading
+
+from PySide6 import QtCore
+
+
+class SignalCoalescer(QtCore.QObject):
+    '''
+    合併高頻率的跨執行緒 signal
+    來源 signal 以 DirectConnection 在 worker 執行緒寫入 buffer
+    每個 interval (ms) 最多只送出一個跨執行緒事件, 由 coalescer 所在的執行緒 (GUI) 送出 delivered
+    '''
+    scheduled = QtCore.Signal()
+
+    def __init__(self, interval: int = 50, parent=None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        self.armed = False
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(interval)
+        self.flush_timer.timeout.connect(self.flush)
+        self.scheduled.connect(self.schedule)
+
+    def connect_source(self, signal):
+        signal.connect(self.push, QtCore.Qt.DirectConnection)
+
+    def push(self, value):
+        '''
+        可以在任何執行緒呼叫
+        '''
+        with self.lock:
+            self.store(value)
+            first = not self.armed
+            self.armed = True
+        if first:
+            self.scheduled.emit()
+
+    @QtCore.Slot()
+    def schedule(self):
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    @QtCore.Slot()
+    def flush(self):
+        with self.lock:
+            value = self.take()
+            self.armed = False
+        self.deliver(value)
+
+    def store(self, value):
+        raise NotImplementedError
+
+    def take(self):
+        raise NotImplementedError
+
+    def deliver(self, value):
+        raise NotImplementedError
+
+
+class LatestValueCoalescer(SignalCoalescer):
+    '''
+    只保留最後一個值, 例如進度
+    '''
+    delivered = QtCore.Signal(object)
+
+    value = None
+
+    def store(self, value):
+        self.value = value
+
+    def take(self):
+        return self.value
+
+    def deliver(self, value):
+        self.delivered.emit(value)
+
+
+class BatchCoalescer(SignalCoalescer):
+    '''
+    依序累積所有值, 一次以 list 送出, 例如 log 與回應
+    '''
+    delivered = QtCore.Signal(list)
+
+    def __init__(self, interval: int = 50, parent=None):
+        super().__init__(interval, parent)
+        self.values = []
+
+    def store(self, value):
+        self.values.append(value)
+
+    def take(self):
+        values, self.values = self.values, []
+        return values
+
+    def deliver(self, values):
+        if len(values) > 0:
+            self.delivered.emit(values)
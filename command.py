@@ -1,12 +1,94 @@
+import functools
+
+
+commands = {}
+'''
+以指令名稱註冊的 Command
+'''
+
+TERMINATOR = b'\r\n'
+
 
 class Command(object):
-    pass
+    '''
+    name 為送到韌體的指令名稱
+    有 name 的子類別會自動註冊到 commands
+    '''
+    name = ''
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name:
+            commands[cls.name] = cls()
+
+    def encode(self, *args) -> bytes:
+        raise NotImplementedError
+
 
 class ScriptCommand(Command):
+    '''
+    template 以 {} 標示需要替換的欄位
+    建立時先編碼成 bytes 片段, 送出時只需要把參數接進去
+    '''
     template = ''
 
+    def __init__(self):
+        self.segments = [segment.encode('utf8') for segment in self.template.split('{}')]
+        self.segments[-1] += TERMINATOR
+        self.fields = len(self.segments) - 1
+        # 相同參數直接回傳已編碼的結果
+        self.encode = functools.lru_cache(maxsize=256)(self.build)
+
+    def build(self, *args) -> bytes:
+        if len(args) != self.fields:
+            raise ValueError(f'{self.name} expects {self.fields} fields, got {len(args)}')
+        parts = [self.segments[0]]
+        for arg, segment in zip(args, self.segments[1:]):
+            parts.append(str(arg).encode('utf8'))
+            parts.append(segment)
+        return b''.join(parts)
+
+
 class BasicCommand(Command):
-    pass
+    '''
+    沒有參數的指令, 只編碼一次
+    '''
+
+    def __init__(self):
+        self.encoded = self.name.encode('utf8') + TERMINATOR
+
+    def encode(self) -> bytes:
+        return self.encoded
+
+
+class HomeCommand(BasicCommand):
+    name = 'home'
+
+
+class MoveStnXCommand(ScriptCommand):
+    name = 'MoveStnX'
+    template = 'MoveStnX\t{}\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx'
+
+
+class SuspendCommand(ScriptCommand):
+    '''
+    0: 繼續, 1: 暫停, 2: 中斷
+    '''
+    name = 'suspend'
+    template = 'suspend[{}]'
+
+
+class StatusCommand(ScriptCommand):
+    '''
+    查詢機台狀態, 韌體只回傳一行 status, 沒有 ack 與 FlowDone
+    '''
+    name = 'status'
+    template = 'status[{}]'
 
 
-class HomeCommand(ScriptCommand):
+@functools.lru_cache(maxsize=4096)
+def encode_line(line: str) -> bytes:
+    '''
+    將介面或腳本中的一行指令編碼, 重複的指令直接使用快取
+    '''
+    return line.encode('utf8') + TERMINATOR
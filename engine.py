@@ -0,0 +1,316 @@
+import threading
+from enum import IntEnum
+
+from PySide6 import QtCore, QtSerialPort
+from command import encode_line
+from response import ResponseKind, Response, classify
+from framing import FrameDecoder, PROTOCOL_TEXT, PROTOCOL_BINARY, FRAME_TIMEOUT, encode_line_frame
+from flow_source import FlowSource, ListFlowSource
+from flow_state import FlowState
+from tracing import CommandTracer, TraceStage
+
+
+class CommandLevelEnum(IntEnum):
+    EMERGENCY = 1
+    STATUS = 2
+    NORMAL = 3
+
+
+NEGOTIATE_TIMEOUT = 500
+'''
+送出 proto[1] 後等待韌體回應的時間 (ms), 逾時維持文字模式
+'''
+
+
+class FlowWorker(QtCore.QObject):
+    send_log = QtCore.Signal(str)
+    send_command = QtCore.Signal(str)
+    send_percentange = QtCore.Signal(int)
+    step_done = QtCore.Signal(int)
+
+    current_command = ''
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # window, dependent 指令與 checkpoint 由 FlowState 處理, 與 asyncio backend 共用
+        self.state = FlowState()
+        self.tracer = CommandTracer()
+
+    def set_command_list(self, command_list: list):
+        self.send_log.emit('set command list')
+        self.set_command_source(ListFlowSource(command_list))
+
+    def set_command_source(self, source: FlowSource):
+        '''
+        指令由 source 逐行提供, 不需要一次載入整個腳本
+        '''
+        self.state.set_source(source)
+
+    def set_checkpoint(self, path: str, resume: bool = False):
+        '''
+        每完成一步寫入 checkpoint
+        resume 時直接 seek 到最後完成的位置, 不重新執行已完成的指令
+        '''
+        if self.state.set_checkpoint(path, resume):
+            self.send_log.emit(f'resume from step {self.state.current_line}')
+
+    def set_window(self, window: int):
+        self.state.set_window(window)
+
+    def do_terminate(self):
+        # 保留 checkpoint 供下次 resume
+        self.state.close()
+        self.current_command = ''
+
+    def is_finished(self):
+        return self.state.finished()
+
+    def process_responses(self, responses: list):
+        for response in responses:
+            self.process_response(response)
+
+    def process_response(self, response):
+        '''
+        response 為文字模式的一行 bytes, 或 binary 模式已解碼的 Response
+        '''
+        self.send_log.emit(threading.current_thread().name + str(threading.current_thread().ident))
+        if len(self.state.in_flight) == 0:
+            return
+
+        if not isinstance(response, Response):
+            response = classify(response)
+        kind = response.kind
+        if kind == ResponseKind.FLOW_DONE:
+            record = self.state.complete()
+            self.tracer.finish(record.trace_id)
+            self.step_done.emit(record.sequence)
+            self.send_percentange.emit(int(self.state.percentage(record.position)))
+            if self.state.source.peek() is not None:
+                self.send_log.emit(f'next: {record.sequence} done')
+                self.start_flow()
+        elif kind == ResponseKind.ACK:
+            record = self.state.ack()
+            if record is not None:
+                self.tracer.stamp(record.trace_id, TraceStage.ACK)
+
+    def start_flow(self):
+        '''
+        補滿 window, 送出可以同時執行的指令
+        '''
+        while True:
+            record = self.state.next_record()
+            if record is None:
+                break
+            record.trace_id = self.tracer.begin(record.command)
+            self.current_command = record.command
+            self.tracer.stamp(record.trace_id, TraceStage.DEQUEUE)
+            self.send_command.emit(record.command)
+            # CommandWorker 在其他執行緒時, 此時間為送進 queued signal 的時間
+            self.tracer.stamp(record.trace_id, TraceStage.WRITE)
+
+
+class CommandWorker(QtCore.QObject):
+    send_log = QtCore.Signal(str)
+    receive_responses = QtCore.Signal(list)
+    protocol_changed = QtCore.Signal(int)
+    port_error = QtCore.Signal(str)
+    '''
+    port 無法開啟, 或使用中發生無法恢復的錯誤 (例如被拔除)
+    '''
+
+    serial = None
+    running_flow = False
+    recorder = None
+
+    prefer_binary = False
+    '''
+    開啟 port 後以 proto[1] 協商 binary frame, 韌體不支援時維持文字模式
+    '''
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # 跨 readyRead 保留尚未收到換行的資料
+        self.response_buffer = bytearray()
+        # binary 模式才有 decoder
+        self.decoder = None
+        # 不完整的 frame 逾時後由 decoder 捨棄, 在 binary 模式開始時建立
+        self.frame_timer = None
+        self.negotiating = False
+        self.negotiation = 0
+        # 不認得 proto 的韌體以 ack 回應 proto[1] 時, 之後還會送出屬於 proto[1] 的 FlowDone
+        self.skip_flow_done = False
+        # 協商期間送出的指令, 決定模式後再送出
+        self.pending_commands = []
+
+    @QtCore.Slot(bool)
+    def set_binary(self, enabled: bool):
+        self.prefer_binary = enabled
+
+    def set_recorder(self, recorder):
+        '''
+        所有讀寫都寫入 TrafficRecorder, None 停止錄製
+        '''
+        self.recorder = recorder
+
+    def write(self, data: bytes):
+        if self.recorder is not None:
+            self.recorder.record_write(data)
+        self.serial.write(data)
+
+    def open_uart(self, port: str):
+        self.send_log.emit(str(threading.current_thread().ident))
+        self.serial = QtSerialPort.QSerialPort()
+        self.serial.setPortName(port)
+        self.serial.setBaudRate(115200)
+        result = self.serial.open(QtCore.QIODevice.ReadWrite)
+        self.send_log.emit(f'uart open: {result}')
+        self.response_buffer.clear()
+        self.decoder = None
+        self.skip_flow_done = False
+        if not result:
+            self.port_error.emit(f'{port}: {self.serial.errorString()}')
+            return
+        self.serial.readyRead.connect(self.read_response)
+        self.serial.errorOccurred.connect(self.handle_error)
+        if self.prefer_binary:
+            self.negotiate()
+
+    def handle_error(self, error):
+        if error in (QtSerialPort.QSerialPort.NoError, QtSerialPort.QSerialPort.TimeoutError):
+            return
+        self.port_error.emit(f'{self.serial.portName()}: {self.serial.errorString()}')
+
+    def negotiate(self):
+        self.negotiating = True
+        self.negotiation += 1
+        negotiation = self.negotiation
+        self.write(encode_line(f'proto[{PROTOCOL_BINARY}]'))
+        QtCore.QTimer.singleShot(NEGOTIATE_TIMEOUT, lambda: self.negotiate_timeout(negotiation))
+
+    def negotiate_timeout(self, negotiation: int):
+        if self.negotiating and negotiation == self.negotiation:
+            self.finish_negotiation(False)
+
+    def finish_negotiation(self, binary: bool):
+        self.negotiating = False
+        if binary:
+            self.decoder = FrameDecoder()
+            if self.frame_timer is None:
+                self.frame_timer = QtCore.QTimer(self)
+                self.frame_timer.setSingleShot(True)
+                self.frame_timer.setInterval(int(FRAME_TIMEOUT * 1000))
+                self.frame_timer.timeout.connect(self.expire_frames)
+        protocol = PROTOCOL_BINARY if binary else PROTOCOL_TEXT
+        self.send_log.emit(f'protocol: {protocol}')
+        self.protocol_changed.emit(protocol)
+
+        pending, self.pending_commands = self.pending_commands, []
+        for command in pending:
+            self.write_command(command)
+
+    def read_negotiation(self) -> list:
+        '''
+        協商中逐行讀取, 韌體回傳 proto[1] 之後的資料都是 frame
+        '''
+        responses = []
+        while self.negotiating:
+            end = self.response_buffer.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(self.response_buffer[:end + 1])
+            del self.response_buffer[:end + 1]
+
+            response = classify(line)
+            if response.kind == ResponseKind.PROTOCOL:
+                self.finish_negotiation(response.fields[:1] == (PROTOCOL_BINARY,))
+            elif response.kind == ResponseKind.ERROR:
+                # 不認得 proto 的韌體
+                self.finish_negotiation(False)
+            elif response.kind in (ResponseKind.ACK, ResponseKind.FLOW_DONE):
+                # 不認得 proto 的韌體當作一般指令回應, 不能交給 FlowWorker 完成尚未送出的指令
+                self.skip_flow_done = response.kind == ResponseKind.ACK
+                self.finish_negotiation(False)
+            else:
+                responses.append(line)
+
+        if self.decoder is not None and len(self.response_buffer) > 0:
+            responses += self.decoder.feed_responses(self.response_buffer)
+            self.response_buffer.clear()
+        return responses
+
+    def read_lines(self) -> list:
+        end = self.response_buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        lines = bytes(self.response_buffer[:end]).split(b'\n')
+        responses = [line + b'\n' for line in lines]
+        del self.response_buffer[:end + 1]
+        if self.skip_flow_done:
+            for index, line in enumerate(responses):
+                if classify(line).kind == ResponseKind.FLOW_DONE:
+                    # 屬於 proto[1], 韌體依序執行, 一定比後續指令的 FlowDone 先到
+                    self.skip_flow_done = False
+                    del responses[index]
+                    break
+        return responses
+
+    @QtCore.Slot()
+    def read_response(self):
+        if not self.serial or not self.serial.isOpen():
+            return
+
+        # 韌體短時間回傳多筆時一次讀完, 所有完整的回應合併成一個 signal
+        data = self.serial.readAll().data()
+        if self.recorder is not None:
+            self.recorder.record_read(data)
+        if self.decoder is not None:
+            responses = self.decoder.feed_responses(data)
+        else:
+            self.response_buffer += data
+            responses = self.read_negotiation() if self.negotiating else []
+            if self.decoder is None and not self.negotiating:
+                # 協商在這次讀取中結束時, 剩下的資料也一併處理
+                responses += self.read_lines()
+
+        if self.decoder is not None:
+            # 資料中斷在 frame 中間時, 逾時後捨棄, 不等待永遠不會來的資料
+            if self.decoder.pending():
+                self.frame_timer.start()
+            else:
+                self.frame_timer.stop()
+
+        if len(responses) == 0:
+            return
+        self.receive_responses.emit(responses)
+        self.send_log.emit(f'response: {responses}')
+
+    @QtCore.Slot()
+    def expire_frames(self):
+        if self.decoder is None:
+            return
+        responses = self.decoder.expire_responses()
+        self.send_log.emit(f'frame timeout, dropped: {self.decoder.dropped}')
+        if len(responses) == 0:
+            return
+        self.receive_responses.emit(responses)
+        self.send_log.emit(f'response: {responses}')
+
+    @QtCore.Slot(str)
+    def send_command(self, command: str):
+        self.write_command(encode_line(command))
+
+    @QtCore.Slot(bytes)
+    def write_command(self, command: bytes):
+        '''
+        command 為文字指令, binary 模式下轉為 frame 再送出
+        '''
+        if self.negotiating:
+            self.pending_commands.append(command)
+            return
+        if self.decoder is not None:
+            command = encode_line_frame(command)
+        if self.serial and self.serial.isOpen():
+            self.write(command)
+            self.send_log.emit(f'sending: {command}')
+        else:
+            self.send_log.emit('no serail port')
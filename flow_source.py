@@ -0,0 +1,115 @@
+import os
+import mmap
+import collections
+
+
+class FlowSource(object):
+    '''
+    依序提供 flow 的指令
+    next() 回傳 (指令, position), position 為完成這一行後的進度, total 為進度的上限
+    '''
+    total = 0
+
+    def peek(self):
+        raise NotImplementedError
+
+    def next(self):
+        raise NotImplementedError
+
+    def seek(self, position: int):
+        raise NotImplementedError
+
+    def percentage(self, position: int):
+        if self.total == 0:
+            return 100
+        return position / self.total * 100
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            item = self.next()
+            if item is None:
+                return
+            yield item
+
+
+class ListFlowSource(FlowSource):
+    '''
+    由介面上的指令清單建立, position 為行號
+    '''
+
+    def __init__(self, command_list: list):
+        self.command_list = command_list
+        self.total = len(command_list)
+        self.index = 0
+
+    def peek(self):
+        if self.index >= self.total:
+            return None
+        return self.command_list[self.index], self.index + 1
+
+    def next(self):
+        item = self.peek()
+        if item is not None:
+            self.index += 1
+        return item
+
+    def seek(self, position: int):
+        self.index = position
+
+
+class FileFlowSource(FlowSource):
+    '''
+    以 mmap 逐行讀取腳本, 記憶體中只保留 lookahead 行
+    position 為 byte offset, 可以直接 seek 回任意一行的開頭
+    '''
+
+    def __init__(self, path: str, lookahead: int = 64, encoding: str = 'utf8'):
+        self.path = path
+        self.lookahead = lookahead
+        self.encoding = encoding
+        self.file = open(path, 'rb')
+        self.total = os.fstat(self.file.fileno()).st_size
+        # 空檔案無法 mmap
+        self.map = None
+        if self.total > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset = 0
+        self.buffer = collections.deque()
+
+    def fill(self):
+        while len(self.buffer) < self.lookahead and self.offset < self.total:
+            end = self.map.find(b'\n', self.offset)
+            if end < 0:
+                end = self.total
+            line = self.map[self.offset:end].rstrip(b'\r')
+            self.offset = min(end + 1, self.total)
+            # 略過空白行
+            if line.strip():
+                self.buffer.append((line.decode(self.encoding), self.offset))
+
+    def peek(self):
+        if len(self.buffer) == 0:
+            self.fill()
+        if len(self.buffer) == 0:
+            return None
+        return self.buffer[0]
+
+    def next(self):
+        item = self.peek()
+        if item is not None:
+            self.buffer.popleft()
+        return item
+
+    def seek(self, position: int):
+        self.offset = position
+        self.buffer.clear()
+
+    def close(self):
+        self.buffer.clear()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
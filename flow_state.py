@@ -0,0 +1,134 @@
+import collections
+
+from flow_source import FlowSource, ListFlowSource
+from checkpoint import CheckpointJournal
+
+
+FLOW_WINDOW = 1
+'''
+同時送出但尚未收到 FlowDone 的指令數量上限
+預設為 1, 逐筆等待 FlowDone; 韌體可以暫存指令時才以 set_window 開啟 pipeline
+'''
+
+DEPENDENT_COMMANDS = frozenset(('home',))
+'''
+必須等前面的指令全部完成才送出, 且完成前不再送出後續指令的指令名稱
+'''
+
+
+class FlowRecord(object):
+    '''
+    已送出的指令, 依序號追蹤 ack 與 FlowDone
+    '''
+
+    def __init__(self, sequence: int, command: str, dependent: bool, position: int, trace_id: int = None):
+        self.sequence = sequence
+        self.command = command
+        self.dependent = dependent
+        # 完成後 flow 的進度, 由 FlowSource 決定單位
+        self.position = position
+        self.acked = False
+        self.trace_id = trace_id
+
+
+class FlowState(object):
+    '''
+    flow 的進度, 不依賴 Qt, engine.FlowWorker 與 run_flow 的 asyncio backend 共用
+    韌體依序執行, 完成的一定是 in_flight 中最早送出的指令, 每完成一步寫入 checkpoint
+    '''
+
+    def __init__(self, source: FlowSource = None, window: int = FLOW_WINDOW,
+                 dependent_commands=DEPENDENT_COMMANDS):
+        self.source = source if source is not None else ListFlowSource([])
+        self.window = max(1, window)
+        self.dependent_commands = dependent_commands
+        self.in_flight = collections.deque()
+        self.sequence = 0
+        self.current_line = 0
+        self.journal = None
+
+    def set_source(self, source: FlowSource):
+        self.source = source
+
+    def set_window(self, window: int):
+        self.window = max(1, window)
+
+    def set_checkpoint(self, path: str, resume: bool = False) -> bool:
+        '''
+        每完成一步寫入 checkpoint
+        resume 時直接 seek 到最後完成的位置, 回傳是否由 checkpoint 繼續
+        '''
+        resumed = False
+        if resume:
+            checkpoint = CheckpointJournal.load(path, self.source.total)
+            if checkpoint is not None:
+                self.current_line, position = checkpoint
+                self.source.seek(position)
+                resumed = True
+        self.journal = CheckpointJournal(path, self.source.total, resume)
+        return resumed
+
+    def is_dependent(self, command: str):
+        return command.split('\t', 1)[0] in self.dependent_commands
+
+    def can_send(self, command: str):
+        if len(self.in_flight) >= self.window:
+            return False
+        if len(self.in_flight) == 0:
+            return True
+        return not self.in_flight[-1].dependent and not self.is_dependent(command)
+
+    def next_record(self):
+        '''
+        下一個可以送出的指令, window 已滿或必須等待前面的指令完成時回傳 None
+        '''
+        item = self.source.peek()
+        if item is None or not self.can_send(item[0]):
+            return None
+        command, position = self.source.next()
+        self.sequence += 1
+        record = FlowRecord(self.sequence, command, self.is_dependent(command), position)
+        self.in_flight.append(record)
+        return record
+
+    def ack(self):
+        '''
+        ack 屬於最早尚未 ack 的指令, 沒有時回傳 None
+        '''
+        for record in self.in_flight:
+            if not record.acked:
+                record.acked = True
+                return record
+        return None
+
+    def complete(self):
+        '''
+        最早送出的指令完成, 回傳其 FlowRecord
+        '''
+        record = self.in_flight.popleft()
+        self.current_line += 1
+        if self.journal is not None:
+            self.journal.append(self.current_line, record.position)
+            if self.finished():
+                # flow 完成, 下次重新開始
+                self.journal.close(remove=True)
+                self.journal = None
+        return record
+
+    def finished(self):
+        return self.source.peek() is None and len(self.in_flight) == 0
+
+    def percentage(self, position: int):
+        return self.source.percentage(position)
+
+    def close(self, remove: bool = False):
+        '''
+        remove 為 False 時保留 checkpoint 供下次 resume
+        '''
+        if self.journal is not None:
+            self.journal.close(remove)
+            self.journal = None
+        self.source.close()
+        self.source = ListFlowSource([])
+        self.current_line = 0
+        self.in_flight.clear()
@@ -0,0 +1,327 @@
+import re
+import time
+import struct
+import binascii
+import functools
+
+from command import TERMINATOR
+from response import ResponseKind, Response, classify
+
+
+SYNC = 0xA5
+'''
+每個 frame 的第一個 byte, CRC 錯誤或資料遺失時以此重新同步
+'''
+
+HEADER = struct.Struct('<BBB')
+'''
+sync, opcode, payload 長度
+'''
+
+CRC = struct.Struct('<H')
+'''
+CRC16-CCITT (初始值 0xFFFF), 範圍為 opcode, 長度與 payload
+'''
+
+MAX_PAYLOAD = 0xFF
+
+PROTOCOL_TEXT = 0
+PROTOCOL_BINARY = 1
+'''
+以文字指令 proto[1] 協商, 韌體回傳 proto[1] 後雙方改用 binary frame
+回傳其他內容或逾時則維持文字模式
+'''
+
+OP_TEXT = 0x00
+'''
+沒有對應 opcode 的指令或回應, payload 為去掉換行的文字
+'''
+OP_TEXT_PART = 0x05
+'''
+超過 MAX_PAYLOAD 的文字切成多個 frame, 前面的片段為 OP_TEXT_PART, 最後一段為 OP_TEXT
+'''
+OP_HOME = 0x01
+OP_MOVE_STN_X = 0x02
+OP_SUSPEND = 0x03
+OP_PROTOCOL = 0x04
+OP_ACK = 0x10
+OP_FLOW_DONE = 0x11
+OP_ERROR = 0x12
+
+MOVE_FIELDS = 16
+MOVE_MASK = struct.Struct('<H')
+'''
+MoveStnX 的欄位: bit i 表示第 i 個欄位有值, 只送出有值的欄位 (int32), x 不佔空間
+'''
+MOVE_VALUE = struct.Struct('<i')
+LEVEL = struct.Struct('<B')
+
+LEVEL_PATTERN = re.compile(rb'(suspend|proto)\[(\d+)\]', re.IGNORECASE)
+
+RESPONSE_KINDS = {
+    OP_ACK: ResponseKind.ACK,
+    OP_FLOW_DONE: ResponseKind.FLOW_DONE,
+    OP_SUSPEND: ResponseKind.SUSPEND,
+    OP_PROTOCOL: ResponseKind.PROTOCOL,
+    OP_ERROR: ResponseKind.ERROR,
+}
+
+PAYLOAD_LIMITS = {
+    OP_TEXT: (0, MAX_PAYLOAD),
+    OP_TEXT_PART: (MAX_PAYLOAD, MAX_PAYLOAD),
+    OP_HOME: (0, 0),
+    OP_MOVE_STN_X: (MOVE_MASK.size, MOVE_MASK.size + MOVE_FIELDS * MOVE_VALUE.size),
+    OP_SUSPEND: (LEVEL.size, LEVEL.size),
+    OP_PROTOCOL: (LEVEL.size, LEVEL.size),
+    OP_ACK: (0, 0),
+    OP_FLOW_DONE: (0, 0),
+    OP_ERROR: (0, MAX_PAYLOAD),
+}
+'''
+各 opcode 的 payload 長度範圍
+假的 SYNC 或長度錯誤的 header 不必等到整個長度收齊就能重新同步
+'''
+
+OPCODES = frozenset(PAYLOAD_LIMITS)
+
+FRAME_TIMEOUT = 0.1
+'''
+收到不完整的 frame 後超過此時間 (秒) 沒有新資料, 捨棄其 SYNC 重新尋找
+長度錯誤的 OP_TEXT / OP_ERROR 無法由 header 判斷, 韌體停止送出時只能以逾時恢復
+'''
+
+SIMPLE_LINES = {
+    b'home': OP_HOME,
+    b'ack': OP_ACK,
+    b'flowdone': OP_FLOW_DONE,
+}
+
+
+def crc16(data) -> int:
+    # binascii.crc_hqx 即為 CRC16-CCITT, 以 C 實作
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(opcode: int, payload: bytes = b'') -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f'frame payload too long: {len(payload)}')
+    body = bytes((opcode, len(payload))) + payload
+    return bytes((SYNC,)) + body + CRC.pack(crc16(body))
+
+
+def encode_text_frames(line: bytes) -> bytes:
+    '''
+    任意長度的文字, 不會丟出例外
+    '''
+    parts = []
+    while len(line) > MAX_PAYLOAD:
+        parts.append(encode_frame(OP_TEXT_PART, line[:MAX_PAYLOAD]))
+        line = line[MAX_PAYLOAD:]
+    parts.append(encode_frame(OP_TEXT, line))
+    return b''.join(parts)
+
+
+def pack_move(fields: list) -> bytes:
+    '''
+    欄位不是 x 也不是整數時回傳 None, 改以 OP_TEXT 送出
+    '''
+    if len(fields) != MOVE_FIELDS:
+        return None
+    mask = 0
+    values = []
+    for index, field in enumerate(fields):
+        if field == b'x':
+            continue
+        try:
+            values.append(MOVE_VALUE.pack(int(field)))
+        except (ValueError, struct.error):
+            return None
+        mask |= 1 << index
+    return MOVE_MASK.pack(mask) + b''.join(values)
+
+
+@functools.lru_cache(maxsize=4096)
+def encode_line_frame(line: bytes) -> bytes:
+    '''
+    將一行文字指令或回應 (可含換行) 轉為 frame, 重複的內容直接使用快取
+    '''
+    line = line.rstrip(b'\r\n')
+    opcode = SIMPLE_LINES.get(line.lower())
+    if opcode is not None:
+        return encode_frame(opcode)
+
+    match = LEVEL_PATTERN.fullmatch(line)
+    if match is not None:
+        level = int(match.group(2))
+        opcode = OP_SUSPEND if match.group(1).lower() == b'suspend' else OP_PROTOCOL
+        if level <= 0xFF:
+            return encode_frame(opcode, LEVEL.pack(level))
+
+    fields = line.split(b'\t')
+    if fields[0] == b'MoveStnX':
+        payload = pack_move(fields[1:])
+        if payload is not None:
+            return encode_frame(OP_MOVE_STN_X, payload)
+
+    if line.lower().startswith(b'error') and len(line) - 5 <= MAX_PAYLOAD:
+        return encode_frame(OP_ERROR, line[5:])
+    return encode_text_frames(line)
+
+
+def encode_command_frame(command: str) -> bytes:
+    return encode_line_frame(command.encode('utf8'))
+
+
+def decode_line(opcode: int, payload: bytes) -> bytes:
+    '''
+    frame 還原為文字 (含換行), 給只認得文字的一端使用, 例如模擬器
+    '''
+    if opcode == OP_HOME:
+        line = b'home'
+    elif opcode == OP_ACK:
+        line = b'ack'
+    elif opcode == OP_FLOW_DONE:
+        line = b'FlowDone'
+    elif opcode == OP_SUSPEND:
+        line = b'suspend[%d]' % LEVEL.unpack(payload)
+    elif opcode == OP_PROTOCOL:
+        line = b'proto[%d]' % LEVEL.unpack(payload)
+    elif opcode == OP_ERROR:
+        line = b'error' + payload
+    elif opcode == OP_MOVE_STN_X:
+        mask, = MOVE_MASK.unpack_from(payload)
+        fields = [b'MoveStnX']
+        offset = MOVE_MASK.size
+        for index in range(MOVE_FIELDS):
+            if mask & (1 << index):
+                fields.append(b'%d' % MOVE_VALUE.unpack_from(payload, offset))
+                offset += MOVE_VALUE.size
+            else:
+                fields.append(b'x')
+        line = b'\t'.join(fields)
+    else:
+        line = bytes(payload)
+    return line + TERMINATOR
+
+
+def decode_response(opcode: int, payload: bytes) -> Response:
+    '''
+    直接由 opcode 得到 Response, 不需要再比對文字前綴
+    '''
+    kind = RESPONSE_KINDS.get(opcode)
+    if kind is None:
+        # OP_TEXT 與其他 opcode 依文字判斷, 例如 log[n]
+        return classify(payload)
+    if opcode in (OP_SUSPEND, OP_PROTOCOL):
+        return Response(kind, payload, LEVEL.unpack(payload))
+    if opcode == OP_ERROR:
+        # 錯誤很少發生, 沿用文字的欄位解析
+        return classify(b'error' + payload)
+    return Response(kind, payload, ())
+
+
+class FrameDecoder(object):
+    '''
+    串流解碼, feed 可以傳入任意切割的資料
+    CRC 錯誤或長度不合時捨棄一個 byte, 往後尋找下一個 SYNC
+    不完整的 frame 超過 timeout 秒沒有新資料時由 expire 捨棄, 呼叫端在沒有資料時也必須定期呼叫
+    '''
+
+    def __init__(self, timeout: float = FRAME_TIMEOUT, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.last_data = clock()
+        self.buffer = bytearray()
+        # 尚未收到最後一段的 OP_TEXT_PART
+        self.partial = bytearray()
+        # 為了重新同步而捨棄的 byte 數
+        self.dropped = 0
+        self.crc_errors = 0
+        self.timeouts = 0
+
+    def pending(self):
+        '''
+        是否有尚未收齊的 frame
+        '''
+        return len(self.buffer) > 0
+
+    def feed(self, data) -> list:
+        '''
+        回傳完整的 frame: [(opcode, payload)]
+        '''
+        # 上次留下的資料已經逾時, 不與新的資料合併
+        frames = self.expire()
+        self.buffer += data
+        self.last_data = self.clock()
+        return frames + self.scan()
+
+    def expire(self) -> list:
+        '''
+        不完整的 frame 已經逾時, 逐一捨棄 SYNC 並重新解碼剩下的資料
+        '''
+        frames = []
+        if not self.buffer or self.clock() - self.last_data < self.timeout:
+            return frames
+        self.timeouts += 1
+        while self.buffer:
+            del self.buffer[0]
+            self.dropped += 1
+            frames += self.scan()
+        return frames
+
+    def scan(self) -> list:
+        frames = []
+        buffer = self.buffer
+        start = 0
+        size = len(buffer)
+        while True:
+            sync = buffer.find(SYNC, start)
+            if sync < 0:
+                self.dropped += size - start
+                start = size
+                break
+            self.dropped += sync - start
+            start = sync
+            if size - start < HEADER.size:
+                break
+            limits = PAYLOAD_LIMITS.get(buffer[start + 1])
+            length = buffer[start + 2]
+            if limits is None or not limits[0] <= length <= limits[1]:
+                self.dropped += 1
+                start += 1
+                continue
+            end = start + HEADER.size + length + CRC.size
+            if size < end:
+                break
+            body = memoryview(buffer)[start + 1:end - CRC.size]
+            try:
+                valid = CRC.unpack_from(buffer, end - CRC.size)[0] == crc16(body)
+            finally:
+                body.release()
+            if not valid:
+                self.crc_errors += 1
+                self.dropped += 1
+                start += 1
+                continue
+            opcode = buffer[start + 1]
+            payload = bytes(buffer[start + HEADER.size:end - CRC.size])
+            start = end
+            if opcode == OP_TEXT_PART:
+                self.partial += payload
+                continue
+            if opcode == OP_TEXT and self.partial:
+                payload = bytes(self.partial) + payload
+                self.partial.clear()
+            frames.append((opcode, payload))
+        del buffer[:start]
+        return frames
+
+    def feed_responses(self, data) -> list:
+        return [decode_response(opcode, payload) for opcode, payload in self.feed(data)]
+
+    def expire_responses(self) -> list:
+        return [decode_response(opcode, payload) for opcode, payload in self.expire()]
+
+    def reset(self):
+        self.buffer.clear()
+        self.partial.clear()
@@ -0,0 +1,74 @@
+from PySide6 import QtCore
+
+
+class LogModel(QtCore.QAbstractListModel):
+    '''
+    固定容量的 log model
+    超過容量時丟棄最舊的紀錄, 新的 log 先暫存再由 timer 一次加入
+    '''
+
+    def __init__(self, capacity: int = 10000, interval: int = 16, parent=None):
+        super().__init__(parent)
+        self.capacity = capacity
+        # ring buffer, head 指向最舊的一筆
+        self.records = [None] * capacity
+        self.head = 0
+        self.size = 0
+
+        self.pending = []
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(interval)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.size
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        return self.records[(self.head + index.row()) % self.capacity]
+
+    def append(self, message: str):
+        self.pending.append(message)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def extend(self, messages: list):
+        self.pending.extend(messages)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def clear(self):
+        self.beginResetModel()
+        self.records = [None] * self.capacity
+        self.head = 0
+        self.size = 0
+        self.pending = []
+        self.endResetModel()
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if len(pending) == 0:
+            return
+        # 一次寫入超過容量時只需要保留最後的部分
+        if len(pending) > self.capacity:
+            pending = pending[-self.capacity:]
+
+        overflow = self.size + len(pending) - self.capacity
+        if overflow > 0:
+            self.beginRemoveRows(QtCore.QModelIndex(), 0, overflow - 1)
+            for i in range(overflow):
+                self.records[(self.head + i) % self.capacity] = None
+            self.head = (self.head + overflow) % self.capacity
+            self.size -= overflow
+            self.endRemoveRows()
+
+        first = self.size
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(pending) - 1)
+        for i, message in enumerate(pending):
+            self.records[(self.head + first + i) % self.capacity] = message
+        self.size += len(pending)
+        self.endInsertRows()
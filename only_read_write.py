@@ -3,10 +3,60 @@ import serial
 import queue
 import time
 import random
+import threading
 
-from serial.tools import list_ports
 from PySide6 import QtWidgets, QtCore
 from ui_main import Ui_MainWindow
+from log_model import LogModel
+from port_discovery import PortDiscovery, pyserial_ports, apply_port_changes
+from command import encode_line
+from response import ResponseKind, classify
+from tracing import CommandTracer, TraceStage
+from traffic_capture import RecordingSerial
+
+
+class LineReader(object):
+    '''
+    將 serial 收到的資料一次讀進預先配置的 buffer
+    以 \\r\\n 切出完整的回應, 不完整的部分保留到下次讀取
+    '''
+
+    def __init__(self, serial, size: int = 4096):
+        self.serial = serial
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def frames(self):
+        while True:
+            yield from self.split_frames()
+            self.fill()
+
+    def split_frames(self):
+        while True:
+            index = self.buffer.find(b'\r\n', self.start, self.end)
+            if index < 0:
+                return
+            frame = bytes(self.view[self.start:index + 2])
+            self.start = index + 2
+            yield frame
+
+    def fill(self):
+        remain = self.end - self.start
+        if self.start > 0:
+            # 已處理的資料不再需要, 將未完成的行搬回開頭
+            self.view[:remain] = self.view[self.start:self.end]
+            self.start, self.end = 0, remain
+        if self.end == len(self.buffer):
+            # 單行超過 buffer 大小才需要擴充
+            self.view.release()
+            self.buffer = self.buffer + bytearray(len(self.buffer))
+            self.view = memoryview(self.buffer)
+
+        # 沒有資料時阻塞等待第一個 byte, 其餘一次讀完
+        size = min(max(self.serial.in_waiting, 1), len(self.buffer) - self.end)
+        self.end += self.serial.readinto(self.view[self.end:self.end + size])
 
 
 class CommandWorker(QtCore.QThread):
@@ -26,49 +76,67 @@ class CommandWorker(QtCore.QThread):
 
     port = None
     serial = None
+    recorder = None
+    reader = None
 
     def __init__(self):
         super().__init__()
+        self.port_opened = threading.Event()
+        self.tracer = CommandTracer()
 
     def set_command(self, command: str):
         '''
         Slot
         接收由 GUI 產生的指令 Signal
         '''
-        command = f'{command}\r\n'.encode("utf8")
+        command = encode_line(command)
         self.send_logger.emit(f'received command: {command}')
-        self.command_queue.put(command)
+        self.command_queue.put((self.tracer.begin(command), command))
+
+    def set_recorder(self, recorder):
+        '''
+        下次 open_uart 起, 所有讀寫都寫入 TrafficRecorder
+        '''
+        self.recorder = recorder
 
     def open_uart(self, port):
         self.serial = serial.Serial(port, 115200)
+        if self.recorder is not None:
+            self.serial = RecordingSerial(self.serial, self.recorder)
+        self.reader = LineReader(self.serial)
         self.send_logger.emit(f'open uart: {self.serial.is_open}')
+        self.port_opened.set()
 
     def run(self):
         while True:
-            if not self.serial or not self.serial.is_open or self.command_queue.empty():
-                continue
+            self.port_opened.wait()
 
-            command = self.command_queue.get()
+            trace_id, command = self.command_queue.get()
+            self.tracer.stamp(trace_id, TraceStage.DEQUEUE)
 
             self.command_queue.task_done()
 
             self.send_logger.emit(f'sending command: {command}')
 
-            start_time = time.time()
             self.serial.write(command)
-
-            response = None 
+            self.tracer.stamp(trace_id, TraceStage.WRITE)
+            acked = False
 
             # 部分指令的結束訊號為 b'FlowDone\r\n'
             # 通過判斷結束訊號決定是否有未讀取的韌體回傳
-            while response != b'FlowDone\r\n':
-                response = self.serial.readline()
+            for response in self.reader.frames():
                 self.send_logger.emit(f'response: {response}')
-
-                # 放不放好像都不影響但是有的文章建議要 sleep
-                time.sleep(5)
-            
-            self.send_logger.emit(f'time: {time.time() - start_time}')
+                kind = classify(response).kind
+                if kind == ResponseKind.FLOW_DONE:
+                    break
+                if not acked and kind == ResponseKind.ACK:
+                    acked = True
+                    self.tracer.stamp(trace_id, TraceStage.ACK)
+            self.tracer.finish(trace_id)
+            self.received.emit()
+
+            elapsed = self.tracer.elapsed(trace_id, TraceStage.WRITE, TraceStage.FLOW_DONE)
+            self.send_logger.emit(f'time: {elapsed / 1e9}')
         self.finished.emit()
         self.exec()
 
@@ -84,9 +152,17 @@ class MainController(QtWidgets.QMainWindow):
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
-        self.get_com_ports()
+        self.log_model = LogModel(parent=self)
+        self.ui.log_list.setModel(self.log_model)
+        self.ui.clear_button.released.connect(self.log_model.clear)
+
+        # 在背景執行緒列舉 port, 只把變動套用到 ports_combobox
+        self.com_ports = []
+        self.port_discovery = PortDiscovery(pyserial_ports)
+        self.port_discovery.ports_changed.connect(self.update_com_ports)
+        self.port_discovery.start_thread()
 
-        self.ui.refresh_comports_button.released.connect(self.get_com_ports)
+        self.ui.refresh_comports_button.released.connect(self.port_discovery.refresh)
         self.ui.start_button.released.connect(self.start_process)
         self.ui.open_comports_button.released.connect(self.open_uart)
         self.ui.home_button.released.connect(self.send_home_command)
@@ -98,15 +174,21 @@ class MainController(QtWidgets.QMainWindow):
         self.command_worker.start()
 
     def send_home_command(self):
-        self.ui.log_list.addItem('click home button')
+        self.write_log('click home button')
         self.send_command.emit('home')
 
     def open_uart(self):
         port = self.ui.ports_combobox.currentText()
         self.open_uart_connection.emit(port)
 
+    def get_latency_report(self, name: str = None):
+        '''
+        各指令在排隊, 傳輸與韌體所花的時間分布 (ns)
+        '''
+        return self.command_worker.tracer.report(name)
+
     def write_log(self, message: str):
-        self.ui.log_list.addItem(message)
+        self.log_model.append(message)
 
     def start_process(self):
         self.write_log('click start')
@@ -118,10 +200,14 @@ class MainController(QtWidgets.QMainWindow):
             command = self.ui.command_list.currentItem().text()
             self.send_command.emit(command)
 
-    def get_com_ports(self):
-        self.ui.ports_combobox.clear()
-        self.com_ports = [port.name for port in list_ports.comports()]
-        self.ui.ports_combobox.addItems(self.com_ports)
+    def update_com_ports(self, added: list, removed: list):
+        apply_port_changes(self.ui.ports_combobox, added, removed)
+        self.com_ports = self.port_discovery.ports()
+
+    def closeEvent(self, event):
+        # 結束 discovery 執行緒並關閉 inotify
+        self.port_discovery.stop()
+        super().closeEvent(event)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+import struct
+import threading
+
+from PySide6 import QtCore
+
+
+DEBOUNCE = 200
+'''
+/dev 變動後等待的時間 (ms), 插拔時的多個事件只重新列舉一次
+'''
+
+POLL_INTERVAL = 2000
+'''
+無法使用 inotify 的平台, 定期重新列舉的間隔 (ms)
+'''
+
+PORT_PREFIXES = ('tty', 'rfcomm', 'cu.', 'serial')
+'''
+只有這些名稱的 /dev 變動才需要重新列舉
+'''
+
+
+def pyserial_ports():
+    from serial.tools import list_ports
+    return [port.name for port in list_ports.comports()]
+
+
+def qt_ports():
+    from PySide6 import QtSerialPort
+    return [port.portName() for port in QtSerialPort.QSerialPortInfo.availablePorts()]
+
+
+def apply_port_changes(combobox, added: list, removed: list):
+    '''
+    只移除與加入變動的項目, 保留目前的選擇
+    '''
+    for name in removed:
+        index = combobox.findText(name)
+        if index >= 0:
+            combobox.removeItem(index)
+    combobox.addItems(added)
+
+
+class InotifyWatcher(object):
+    '''
+    以 ctypes 呼叫 libc 的 inotify, 監聽目錄中檔案的建立與刪除
+    非 Linux 或呼叫失敗時丟出 OSError
+    '''
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    EVENT = struct.Struct('iIII')
+    '''
+    wd, mask, cookie, name 的長度
+    '''
+
+    def __init__(self, path: str = '/dev'):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch failed: {path}')
+
+    def fileno(self):
+        return self.fd
+
+    def read_names(self) -> list:
+        '''
+        讀出所有事件, 回傳變動的檔案名稱
+        '''
+        names = []
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PortDiscovery(QtCore.QObject):
+    '''
+    在自己的執行緒列舉 serial port 並快取結果
+    Linux 以 inotify 監聽 /dev, 其他平台定期列舉
+    只送出新增與移除的 port
+    '''
+    send_log = QtCore.Signal(str)
+    ports_changed = QtCore.Signal(list, list)
+
+    def __init__(self, enumerator=pyserial_ports, watch_path: str = '/dev',
+                 debounce: int = DEBOUNCE, poll_interval: int = POLL_INTERVAL):
+        super().__init__()
+        self.enumerator = enumerator
+        self.watch_path = watch_path
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        self.lock = threading.Lock()
+        self.known_ports = set()
+
+        self.thread = None
+        self.watcher = None
+        self.notifier = None
+        self.scan_timer = None
+
+    def start_thread(self):
+        '''
+        由建立者的執行緒呼叫, 之後所有工作都在 discovery 執行緒執行
+        '''
+        self.thread = QtCore.QThread()
+        self.moveToThread(self.thread)
+        self.thread.started.connect(self.start)
+        self.thread.start()
+
+    @QtCore.Slot()
+    def start(self):
+        # timer 與 notifier 必須在 discovery 執行緒建立
+        self.scan_timer = QtCore.QTimer(self)
+        self.scan_timer.setSingleShot(True)
+        self.scan_timer.timeout.connect(self.scan)
+
+        try:
+            self.watcher = InotifyWatcher(self.watch_path)
+        except OSError as error:
+            self.send_log.emit(f'port discovery polling: {error}')
+            self.scan_timer.setSingleShot(False)
+            self.scan_timer.setInterval(self.poll_interval)
+            self.scan_timer.start()
+        else:
+            self.scan_timer.setInterval(self.debounce)
+            self.notifier = QtCore.QSocketNotifier(
+                self.watcher.fileno(), QtCore.QSocketNotifier.Read, self
+            )
+            self.notifier.activated.connect(self.read_events)
+
+        self.scan()
+
+    def read_events(self, *args):
+        names = self.watcher.read_names()
+        if any(name.startswith(PORT_PREFIXES) for name in names):
+            # 重新計時, 連續的事件只列舉一次
+            self.scan_timer.start()
+
+    @QtCore.Slot()
+    def refresh(self):
+        '''
+        手動重新列舉, 可以由任何執行緒以 queued signal 呼叫
+        '''
+        self.scan()
+
+    @QtCore.Slot()
+    def scan(self):
+        try:
+            ports = set(self.enumerator())
+        except Exception as error:
+            self.send_log.emit(f'port discovery error: {error!r}')
+            return
+
+        with self.lock:
+            added = sorted(ports - self.known_ports)
+            removed = sorted(self.known_ports - ports)
+            self.known_ports = ports
+        if added or removed:
+            self.ports_changed.emit(added, removed)
+
+    def ports(self) -> list:
+        '''
+        快取的 port, 不會觸發列舉
+        '''
+        with self.lock:
+            return sorted(self.known_ports)
+
+    @QtCore.Slot()
+    def shutdown(self):
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def stop(self):
+        '''
+        由建立者的執行緒呼叫
+        '''
+        if self.thread is None:
+            return
+        QtCore.QMetaObject.invokeMethod(self, 'shutdown', QtCore.Qt.BlockingQueuedConnection)
+        self.thread.quit()
+        self.thread.wait()
+        self.thread = None
@@ -0,0 +1,322 @@
+import sys
+import time
+import asyncio
+import argparse
+import collections
+
+from PySide6 import QtCore
+from engine import CommandWorker, FlowWorker
+from flow_state import FlowState, FLOW_WINDOW
+from flow_source import ListFlowSource
+from response import ResponseKind, Response, classify
+
+
+class PortSession(QtCore.QObject):
+    '''
+    單一 port 的 CommandWorker 與 FlowWorker
+    每個 port 有自己的指令與流程狀態
+    flow_finished(port, 是否成功): 全部完成, port 錯誤或韌體回傳 error 時送出
+    '''
+    send_log = QtCore.Signal(str)
+    flow_finished = QtCore.Signal(str, bool)
+
+    open_requested = QtCore.Signal(str)
+    flow_requested = QtCore.Signal(list)
+
+    def __init__(self, port: str, parent=None):
+        super().__init__(parent)
+        self.port = port
+        self.completed = 0
+        self.total = 0
+        self.running = False
+        # port 錯誤後不再執行 flow
+        self.error = None
+
+        self.command_worker = CommandWorker(self)
+        self.flow_worker = FlowWorker(self)
+
+        self.flow_worker.send_command.connect(self.command_worker.send_command)
+        self.command_worker.receive_responses.connect(self.flow_worker.process_responses)
+        self.command_worker.receive_responses.connect(self.check_responses)
+        self.command_worker.port_error.connect(self.fail_port)
+        self.flow_worker.step_done.connect(self.count_step)
+        self.command_worker.send_log.connect(self.forward_log)
+        self.flow_worker.send_log.connect(self.forward_log)
+
+        # 由其他執行緒 emit, 會排進 session 所在的 I/O 執行緒執行
+        self.open_requested.connect(self.command_worker.open_uart)
+        self.flow_requested.connect(self.run_flow)
+
+    def forward_log(self, message: str):
+        self.send_log.emit(f'[{self.port}] {message}')
+
+    def run_flow(self, command_list: list):
+        self.completed = 0
+        self.total = len(command_list)
+        self.running = True
+        self.flow_worker.do_terminate()
+        if self.error is not None:
+            self.finish(False)
+            return
+        if self.total == 0:
+            self.finish(True)
+            return
+        self.flow_worker.set_command_list(command_list)
+        self.flow_worker.start_flow()
+
+    def finish(self, success: bool):
+        if not self.running:
+            return
+        self.running = False
+        if not success:
+            self.flow_worker.do_terminate()
+        self.flow_finished.emit(self.port, success)
+
+    def fail_port(self, message: str):
+        self.error = message
+        self.forward_log(f'port error: {message}')
+        self.finish(False)
+
+    def check_responses(self, responses: list):
+        for response in responses:
+            if not isinstance(response, Response):
+                response = classify(response)
+            if response.kind == ResponseKind.ERROR:
+                self.forward_log(f'firmware error: {bytes(response.payload)!r}')
+                self.finish(False)
+                return
+
+    def count_step(self, sequence: int):
+        self.completed += 1
+        if self.completed == self.total:
+            self.finish(True)
+
+
+class AsyncPortSession(QtCore.QObject):
+    '''
+    以 AsyncSerialPort 控制單一 port, 介面與 PortSession 相同
+    所有 port 共用 AsyncioBridge 的 event loop, 結果經由 bridge 回到建立 session 的執行緒
+    '''
+    send_log = QtCore.Signal(str)
+    flow_finished = QtCore.Signal(str, bool)
+
+    open_requested = QtCore.Signal(str)
+    flow_requested = QtCore.Signal(list)
+
+    def __init__(self, port: str, bridge, window: int = FLOW_WINDOW, parent=None):
+        super().__init__(parent)
+        from async_serial import AsyncSerialPort
+
+        self.port = port
+        self.bridge = bridge
+        self.window = window
+        self.completed = 0
+        self.total = 0
+        self.running = False
+        self.error = None
+
+        self.serial_port = AsyncSerialPort(port, window=window)
+        # open 的 concurrent.futures.Future, flow 開始前等待
+        self.opened = None
+
+        self.open_requested.connect(self.open)
+        self.flow_requested.connect(self.run_flow)
+
+    def forward_log(self, message: str):
+        self.send_log.emit(f'[{self.port}] {message}')
+
+    def open(self, port: str):
+        self.opened = self.bridge.submit(self.serial_port.open(), self.check_open)
+
+    def check_open(self, future):
+        if future.exception() is not None:
+            self.fail_port(str(future.exception()))
+
+    def run_flow(self, command_list: list):
+        self.completed = 0
+        self.total = len(command_list)
+        self.running = True
+        if self.error is not None:
+            self.finish(False)
+            return
+        if self.total == 0:
+            self.finish(True)
+            return
+        self.bridge.submit(self.execute(command_list), self.check_flow)
+
+    async def execute(self, command_list: list):
+        '''
+        在 bridge 的 event loop 執行, window 與 dependent 指令由 FlowState 處理
+        '''
+        await asyncio.wrap_future(self.opened)
+        state = FlowState(ListFlowSource(command_list), self.window)
+        # 與 state.in_flight 同樣順序的 send task
+        tasks = collections.deque()
+        try:
+            while not state.finished():
+                record = state.next_record()
+                if record is None:
+                    await tasks.popleft()
+                    state.complete()
+                    self.completed += 1
+                    continue
+                tasks.append(asyncio.ensure_future(self.serial_port.send(record.command)))
+        finally:
+            for task in tasks:
+                task.cancel()
+            state.close()
+
+    def check_flow(self, future):
+        from async_serial import FirmwareError
+
+        if future.cancelled():
+            self.finish(False)
+            return
+        error = future.exception()
+        if error is None:
+            self.finish(True)
+        elif isinstance(error, FirmwareError):
+            self.forward_log(f'firmware error: {error}')
+            self.finish(False)
+        else:
+            self.fail_port(str(error))
+
+    def finish(self, success: bool):
+        if not self.running:
+            return
+        self.running = False
+        self.flow_finished.emit(self.port, success)
+
+    def fail_port(self, message: str):
+        if self.error is None:
+            self.error = message
+            self.forward_log(f'port error: {message}')
+        self.finish(False)
+
+    def close(self):
+        self.bridge.call_soon(self.serial_port.close)
+
+
+class PortManager(QtCore.QObject):
+    '''
+    同時控制多個 serial port
+    qt backend: 所有 port 由固定數量的 I/O 執行緒服務, 預設全部共用一個 event loop
+    asyncio backend: 所有 port 共用一個 AsyncioBridge 的 asyncio event loop
+    '''
+    send_log = QtCore.Signal(str)
+    send_throughput = QtCore.Signal(dict)
+    all_finished = QtCore.Signal()
+
+    def __init__(self, thread_count: int = 1, interval: int = 1000, backend: str = 'qt', parent=None):
+        super().__init__(parent)
+        self.io_threads = []
+        self.bridge = None
+        if backend == 'asyncio':
+            from async_bridge import AsyncioBridge
+            self.bridge = AsyncioBridge(self)
+            self.bridge.send_log.connect(self.send_log)
+        else:
+            for i in range(max(1, thread_count)):
+                thread = QtCore.QThread()
+                thread.start()
+                self.io_threads.append(thread)
+
+        self.sessions = {}
+        self.running = set()
+        self.failed = set()
+
+        self.last_completed = {}
+        self.last_time = time.perf_counter()
+        self.throughput_timer = QtCore.QTimer(self)
+        self.throughput_timer.setInterval(interval)
+        self.throughput_timer.timeout.connect(self.report_throughput)
+        self.throughput_timer.start()
+
+    def add_port(self, port: str):
+        if port in self.sessions:
+            return
+        if self.bridge is not None:
+            session = AsyncPortSession(port, self.bridge, parent=self)
+        else:
+            session = PortSession(port)
+            # 依序分配到各個 I/O 執行緒
+            session.moveToThread(self.io_threads[len(self.sessions) % len(self.io_threads)])
+        session.send_log.connect(self.send_log)
+        session.flow_finished.connect(self.finish_flow)
+        self.sessions[port] = session
+        self.last_completed[port] = 0
+        session.open_requested.emit(port)
+
+    def start_flow(self, port: str, command_list: list):
+        self.running.add(port)
+        self.failed.discard(port)
+        self.sessions[port].flow_requested.emit(command_list)
+
+    def start_all(self, command_list: list):
+        for port in self.sessions:
+            self.start_flow(port, list(command_list))
+
+    def finish_flow(self, port: str, success: bool):
+        self.running.discard(port)
+        if not success:
+            self.failed.add(port)
+        if len(self.running) == 0:
+            self.all_finished.emit()
+
+    def report_throughput(self):
+        '''
+        回報每個 port 與全部 port 每秒完成的指令數
+        '''
+        now = time.perf_counter()
+        elapsed = now - self.last_time
+        self.last_time = now
+
+        ports = {}
+        for port, session in self.sessions.items():
+            completed = session.completed
+            ports[port] = (completed - self.last_completed[port]) / elapsed
+            self.last_completed[port] = completed
+
+        self.send_throughput.emit({
+            'ports': ports,
+            'total': sum(ports.values()),
+        })
+
+    def close(self):
+        self.throughput_timer.stop()
+        if self.bridge is not None:
+            # 排在 bridge 停止之前執行
+            for session in self.sessions.values():
+                session.close()
+            self.bridge.close()
+        for thread in self.io_threads:
+            thread.quit()
+            thread.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run one recipe on many serial ports')
+    parser.add_argument('recipe')
+    parser.add_argument('ports', nargs='+')
+    parser.add_argument('--threads', type=int, default=1, help='I/O threads of the qt backend')
+    parser.add_argument('--backend', choices=['qt', 'asyncio'], default='qt')
+    args = parser.parse_args()
+
+    with open(args.recipe, encoding='utf8') as recipe:
+        command_list = [line.rstrip('\r\n') for line in recipe if line.strip()]
+
+    app = QtCore.QCoreApplication(sys.argv)
+
+    manager = PortManager(args.threads, backend=args.backend)
+    manager.send_throughput.connect(lambda report: print(report, flush=True))
+    manager.all_finished.connect(app.quit)
+    for port in args.ports:
+        manager.add_port(port)
+    manager.start_all(command_list)
+
+    result = app.exec()
+    manager.close()
+    if manager.failed:
+        print(f'failed: {sorted(manager.failed)}', file=sys.stderr, flush=True)
+        result = result or 1
+    sys.exit(result)
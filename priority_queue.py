@@ -1,16 +1,47 @@
+import io
 import sys
 import serial
 import queue
 import time
 import random
+import socket
+import selectors
+import threading
+import collections
 
 
-from serial.tools import list_ports
 from PySide6 import QtWidgets, QtCore
 from ui_main import Ui_MainWindow
+from log_model import LogModel
+from port_discovery import PortDiscovery, pyserial_ports, apply_port_changes
+from command import commands, encode_line
+from response import ResponseKind, classify
+from tracing import CommandTracer, LatencyHistogram, TraceStage
+from scheduler import CommandScheduler
+from flow_source import FileFlowSource
+from status_cache import StatusCache
+from traffic_capture import RecordingSerial
 from enum import IntEnum
 
 
+SOURCE_LOOKAHEAD = 2
+'''
+由 FlowSource 執行時, command_queue 中預先排入的 NORMAL 指令數量
+'''
+
+READ_TIMEOUT = 0.05
+'''
+serial 讀取的 timeout (秒)
+無法使用 selector 的平台 (Windows) 會以此間隔檢查喚醒事件
+'''
+
+STATUS_TIMEOUT = 1.0
+'''
+狀態查詢等待回應的時間上限 (秒)
+逾時的查詢以 TimeoutError 結束, 不再阻擋 NORMAL 指令
+'''
+
+
 class CommandLevelEnum(IntEnum):
     EMERGENCY = 1
     STATUS = 2
@@ -22,108 +53,437 @@ class CommandWorker(QtCore.QThread):
     負責處裡 command 讀寫的執行緒
     '''
     send_log = QtCore.Signal(str)
+    received = QtCore.Signal()
+    status_ready = QtCore.Signal(str, object)
 
-    command_queue = queue.PriorityQueue()
+    command_queue = None
     '''
     負責接受介面產生的指令
-    由迴圈循序執行每項指令
+    每個 CommandLevelEnum 一個 deque, 同 level 內依序執行
     '''
 
     port = None
     serial = None
+    recorder = None
 
     waiting_ack = False
     waiting_flow_done = False
+    waiting_status = False
+    status_deadline = 0.0
 
     has_emergency_command = False
 
+    current_trace = None
+    emergency_trace = None
+
+    command_source = None
+
     def __init__(self):
         super().__init__()
+        # queue 有新指令時由 command_queue.ready 喚醒執行緒
+        self.command_queue = CommandScheduler(CommandLevelEnum)
+        # port 開啟時喚醒執行緒, port 關閉或遺失時清除
+        self.port_opened = threading.Event()
+        # 保護 serial 與 selector 的替換, GUI 執行緒開啟 port, worker 執行緒使用
+        self.port_lock = threading.Lock()
+        # 已被替換的 (serial, selector), 由 worker 執行緒在不使用時關閉
+        self.retired = []
+        # 等待回應時用來打斷 select 的 self-pipe
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector = None
+        self.response_buffer = bytearray()
+        self.tracer = CommandTracer()
+        # 緊急指令從加入到寫出 serial 的時間 (ns)
+        self.emergency_latency = LatencyHistogram()
+        self.status_cache = StatusCache()
+        # 排隊中的狀態查詢 trace_id: key
+        self.status_requests = {}
+        # 已寫出, 等待回應的 key, 韌體依序回應
+        self.status_keys = collections.deque()
+
+    def put_command(self, level: CommandLevelEnum, command: bytes):
+        '''
+        回傳的 handle 可以用 cancel_command 取消尚未送出的指令
+        '''
+        trace_id = self.tracer.begin(command)
+        return self.command_queue.put(level, (trace_id, command))
+
+    def set_command_source(self, source):
+        '''
+        由 source 逐行補充 NORMAL 指令, 不一次排入整個腳本
+        '''
+        with self.command_queue.ready:
+            if self.command_source is not None:
+                self.command_source.close()
+            self.command_source = source
+            self.refill()
+
+    def refill(self):
+        with self.command_queue.ready:
+            while self.command_source is not None and \
+                    self.command_queue.depth(CommandLevelEnum.NORMAL) < SOURCE_LOOKAHEAD:
+                item = self.command_source.next()
+                if item is None:
+                    self.command_source.close()
+                    self.command_source = None
+                    break
+                command, position = item
+                self.put_command(CommandLevelEnum.NORMAL, encode_line(command))
+
+    def request_status(self, key: str):
+        '''
+        回傳 future, 結果也會以 status_ready 送出
+        TTL 內直接使用快取, 同一個 key 查詢中時不重複送出
+        '''
+        future, issue = self.status_cache.lookup(key)
+        if issue:
+            command = commands['status'].encode(key)
+            trace_id = self.tracer.begin(command)
+            with self.command_queue.ready:
+                self.status_requests[trace_id] = key
+                self.command_queue.put(CommandLevelEnum.STATUS, (trace_id, command))
+        return future
+
+    def cancel_status_requests(self):
+        '''
+        排隊中的查詢被清除時取消對應的 future
+        '''
+        with self.command_queue.ready:
+            keys = list(self.status_requests.values())
+            self.status_requests.clear()
+        for key in keys:
+            self.status_cache.cancel(key)
+
+    def cancel_command(self, handle):
+        return self.command_queue.cancel(handle)
+
+    def queue_depths(self):
+        return self.command_queue.depths()
+
+    def put_emergency(self, command: bytes, reset_queue: bool = False):
+        '''
+        緊急指令不等待目前指令的回應, 喚醒執行緒後立即寫出
+        '''
+        trace_id = self.tracer.begin(command)
+        with self.command_queue.ready:
+            self.has_emergency_command = True
+            if reset_queue:
+                self.command_queue.flush()
+                if self.command_source is not None:
+                    self.command_source.close()
+                    self.command_source = None
+            self.command_queue.put(CommandLevelEnum.EMERGENCY, (trace_id, command))
+        if reset_queue:
+            self.cancel_status_requests()
+        self.wakeup()
+
+    def wakeup(self):
+        '''
+        打斷正在等待 serial 回應的執行緒
+        '''
+        try:
+            self.wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            # pipe 已滿代表執行緒一定會被喚醒
+            pass
 
     def set_command(self, command: str):
         self.send_log.emit(f'received command: {command}')
-        formatted_command = command + '\r\n'
-        self.command_queue.put(
-            (CommandLevelEnum.NORMAL, formatted_command.encode('utf8'))
-        )
+        return self.put_command(CommandLevelEnum.NORMAL, encode_line(command))
+
+    def set_encoded_command(self, command: bytes):
+        '''
+        接收已由 Command 編碼完成的指令
+        '''
+        self.send_log.emit(f'received command: {command}')
+        return self.put_command(CommandLevelEnum.NORMAL, command)
 
     def continue_flow(self):
-        command = 'suspend[0]\r\n'.encode('utf8')
+        command = commands['suspend'].encode(0)
         self.send_log.emit('continue flow')
-        self.has_emergency_command = True
-        self.command_queue.put((CommandLevelEnum.EMERGENCY, command))
+        self.put_emergency(command)
 
     def suspend_flow(self):
-        command = 'suspend[1]\r\n'.encode('utf8')
+        command = commands['suspend'].encode(1)
         self.send_log.emit(f'receive suspend {command}')
-        self.has_emergency_command = True
-        self.command_queue.put((CommandLevelEnum.EMERGENCY, command))
+        self.put_emergency(command)
 
     def terminate_flow(self):
-        command = 'suspend[2]\r\n'.encode('utf8')
+        command = commands['suspend'].encode(2)
         self.send_log.emit(f'receive terminate {command}')
-        self.has_emergency_command = True
         # terminate 直接重置 Queue
-        self.command_queue = queue.PriorityQueue()
-        self.command_queue.put((CommandLevelEnum.EMERGENCY, command))
+        self.put_emergency(command, reset_queue=True)
+
+    def set_recorder(self, recorder):
+        '''
+        下次 open_uart 起, 所有讀寫都寫入 TrafficRecorder
+        '''
+        self.recorder = recorder
 
     def open_uart(self, port):
-        self.serial = serial.Serial(port, 115200)
+        '''
+        由 GUI 執行緒呼叫, worker 可能正在等待舊的 port, 替換後喚醒它
+        '''
+        try:
+            device = serial.Serial(port, 115200, timeout=READ_TIMEOUT)
+        except serial.SerialException as error:
+            self.send_log.emit(f'open uart failed: {error}')
+            return
+        if self.recorder is not None:
+            device = RecordingSerial(device, self.recorder)
+        selector = self.create_selector(device)
+        with self.port_lock:
+            # 不經過 None, worker 不會在替換中途看到沒有 port
+            self.retire_port()
+            self.serial = device
+            self.selector = selector
+            self.port_opened.set()
+        self.wakeup()
         self.send_log.emit(f'open uart')
 
+    def retire_port(self):
+        '''
+        呼叫端持有 port_lock
+        舊的 serial 與 selector 可能仍在 worker 的 select 中, 交給 worker 關閉
+        '''
+        if self.serial is not None:
+            self.retired.append((self.serial, self.selector))
+
+    def close_retired(self):
+        with self.port_lock:
+            retired, self.retired = self.retired, []
+        if retired:
+            # 舊 port 沒有讀完的資料
+            self.response_buffer.clear()
+        for device, selector in retired:
+            if selector is not None:
+                selector.close()
+            try:
+                device.close()
+            except OSError:
+                pass
+
+    def lose_port(self, error: OSError):
+        '''
+        port 被拔除或讀寫失敗, 等待中的回應不會再來
+        '''
+        self.send_log.emit(f'port error: {error}')
+        with self.port_lock:
+            self.retire_port()
+            self.serial = None
+            self.selector = None
+            self.port_opened.clear()
+        self.response_buffer.clear()
+        self.waiting_ack = False
+        self.waiting_flow_done = False
+        self.has_emergency_command = False
+        self.current_trace = None
+        self.emergency_trace = None
+        while self.status_keys:
+            self.finish_status(None, ConnectionError(f'port error: {error}'))
+
+    def create_selector(self, device):
+        '''
+        以 fd 監聽 serial 可讀與喚醒事件
+        Windows 的 serial handle 沒有 fd, 回傳 None 改用 read timeout
+        '''
+        try:
+            fileno = device.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+        selector = selectors.DefaultSelector()
+        selector.register(fileno, selectors.EVENT_READ, 'serial')
+        selector.register(self.wakeup_reader, selectors.EVENT_READ, 'wakeup')
+        return selector
+
     def port_is_close(self):
         return self.serial is None or not self.serial.is_open
     
     def wating_response(self):
-        return self.waiting_ack or self.waiting_flow_done
+        return self.waiting_ack or self.waiting_flow_done or self.waiting_status
+
+    def wait_readable(self, timeout: float = None):
+        '''
+        阻塞直到 serial 可讀, 被喚醒或超過 timeout (秒), 回傳 serial 是否可讀
+        '''
+        selector = self.selector
+        if selector is None:
+            return True
+
+        readable = False
+        for key, _ in selector.select(timeout):
+            if key.data == 'wakeup':
+                self.drain_wakeup()
+            else:
+                readable = True
+        return readable
+
+    def drain_wakeup(self):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def read_responses(self):
+        '''
+        讀出目前收到的資料, 逐行處理完整的回應
+        不完整的行留在 buffer 等下次讀取
+        '''
+        self.response_buffer += self.serial.read(self.serial.in_waiting or 1)
+        while True:
+            end = self.response_buffer.find(b'\n')
+            if end < 0:
+                break
+            response = bytes(self.response_buffer[:end + 1])
+            del self.response_buffer[:end + 1]
+            self.process_response(response)
+            self.send_log.emit(f'response: {response}')
 
     def process_response(self, response: bytes):
-        result = response.decode('utf8').lower()
-        if result.find('ack') > -1:
+        result = classify(response)
+        if result.kind == ResponseKind.ACK:
             self.send_log.emit('ack response')
+            self.tracer.stamp(self.current_trace, TraceStage.ACK)
             self.waiting_ack = False
             self.waiting_flow_done = True
-        elif result.find('flowdone') > -1:
+        elif result.kind == ResponseKind.FLOW_DONE:
             self.send_log.emit('flowdone response')
             self.waiting_flow_done = False
-        elif result.find('suspend') > -1:
+            self.tracer.finish(self.current_trace)
+            self.current_trace = None
+            self.received.emit()
+        elif result.kind == ResponseKind.SUSPEND:
             self.send_log.emit('suspend response')
             self.has_emergency_command = False
+            self.tracer.finish(self.emergency_trace)
+            self.emergency_trace = None
+        elif result.kind == ResponseKind.STATUS and len(self.status_keys) > 0:
+            self.finish_status(self.status_value(self.status_keys[0], result.payload))
+        elif result.kind == ResponseKind.ERROR and self.waiting_status:
+            self.finish_status(None, RuntimeError(f'status error: {response}'))
         return result
 
-    def run(self):
+    @staticmethod
+    def status_value(key: str, payload) -> str:
+        '''
+        韌體回傳 status <key> <value>, 快取只保存 value
+        '''
+        text = bytes(payload).decode('utf8', 'replace').strip()
+        if text == key:
+            return ''
+        if text.startswith(key + ' '):
+            return text[len(key) + 1:].strip()
+        return text
+
+    def finish_status(self, value, error: BaseException = None):
+        key = self.status_keys.popleft()
+        self.waiting_status = len(self.status_keys) > 0
+        self.tracer.finish(self.current_trace)
+        self.current_trace = None
+        if error is not None:
+            self.status_cache.fail(key, error)
+            return
+        self.status_cache.resolve(key, value)
+        self.status_ready.emit(key, value)
+
+    def expire_status(self):
+        '''
+        回應遺失或韌體不認得 status[...], 讓等待同一個 key 的 future 失敗
+        '''
+        self.send_log.emit(f'status timeout: {self.status_keys[0]}')
+        # 逾時不列入 latency histogram
+        self.current_trace = None
+        self.finish_status(None, TimeoutError(f'status timeout: {self.status_keys[0]}'))
+
+    def send_emergency(self):
         while True:
-            if self.port_is_close():
-                time.sleep(1)
-                continue
+            handle = self.command_queue.pop((CommandLevelEnum.EMERGENCY,))
+            if handle is None:
+                return
+            self.write_emergency(*handle.item)
 
-            if self.wating_response() and not self.has_emergency_command:
-                response = self.serial.readline()
-                if len(response) > 0:
-                    response = self.process_response(response)
-                    self.send_log.emit(f'response: {response}')
-                continue
+    def write_emergency(self, trace_id: int, command: bytes):
+        self.tracer.stamp(trace_id, TraceStage.DEQUEUE)
 
-            if self.command_queue.empty():
-                time.sleep(1)
-                continue
-            
+        self.emergency_trace = trace_id
+        self.serial.write(command)
+        self.tracer.stamp(trace_id, TraceStage.WRITE)
 
-            priority, command = self.command_queue.get()
+        latency = self.tracer.elapsed(trace_id, TraceStage.ENQUEUE, TraceStage.WRITE)
+        self.emergency_latency.record(latency)
+        self.send_log.emit(f'emergency command: {command} latency: {latency / 1e6:.3f} ms')
 
-            self.send_log.emit(f'current command: {command}')
+    def run(self):
+        while True:
+            self.close_retired()
+            with self.port_lock:
+                closed = self.port_is_close()
+                if closed:
+                    self.port_opened.clear()
+            if closed:
+                self.port_opened.wait()
+                continue
 
+            try:
+                self.process()
+            except OSError as error:
+                # SerialException 也是 OSError
+                self.lose_port(error)
+
+    def process(self):
+        '''
+        送出或等待一次, 由 run 重複呼叫
+        '''
+        self.send_emergency()
+
+        # 等待回應時只有緊急指令可以插隊
+        if self.wating_response() or self.has_emergency_command:
+            timeout = None
+            if self.waiting_status:
+                timeout = max(0.0, self.status_deadline - time.monotonic())
+            if self.wait_readable(timeout):
+                self.read_responses()
+            if self.waiting_status and time.monotonic() >= self.status_deadline:
+                self.expire_status()
+            return
+
+        self.refill()
+        handle = self.command_queue.get()
+        if handle.level == CommandLevelEnum.EMERGENCY:
+            self.write_emergency(*handle.item)
+            return
+
+        trace_id, command = handle.item
+        self.tracer.stamp(trace_id, TraceStage.DEQUEUE)
+
+        self.send_log.emit(f'current command: {command}')
+
+        if handle.level == CommandLevelEnum.STATUS:
+            with self.command_queue.ready:
+                key = self.status_requests.pop(trace_id, None)
+            if key is None:
+                # 取出後才被 terminate 取消
+                return
+            # 狀態查詢只等待一行 status
+            self.status_keys.append(key)
+            self.waiting_status = True
+            self.status_deadline = time.monotonic() + STATUS_TIMEOUT
+        else:
             self.waiting_ack = True
-            self.serial.write(command)
-            time.sleep(0.1)
-
 
+        self.current_trace = trace_id
+        self.serial.write(command)
+        self.tracer.stamp(trace_id, TraceStage.WRITE)
 
 
 class MainController(QtWidgets.QMainWindow):
     command_worker = CommandWorker()
 
     send_command = QtCore.Signal(str)
+    send_encoded_command = QtCore.Signal(bytes)
     open_uart_connection = QtCore.Signal(str)
     send_terminate = QtCore.Signal()
     send_continue = QtCore.Signal()
@@ -135,9 +495,17 @@ class MainController(QtWidgets.QMainWindow):
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
-        self.get_com_ports()
+        self.log_model = LogModel(parent=self)
+        self.ui.log_list.setModel(self.log_model)
+        self.ui.clear_button.released.connect(self.log_model.clear)
+
+        # 在背景執行緒列舉 port, 只把變動套用到 ports_combobox
+        self.com_ports = []
+        self.port_discovery = PortDiscovery(pyserial_ports)
+        self.port_discovery.ports_changed.connect(self.update_com_ports)
+        self.port_discovery.start_thread()
 
-        self.ui.refresh_comports_button.released.connect(self.get_com_ports)
+        self.ui.refresh_comports_button.released.connect(self.port_discovery.refresh)
         self.ui.open_comports_button.released.connect(self.open_uart)
 
         # 正常執行
@@ -154,6 +522,7 @@ class MainController(QtWidgets.QMainWindow):
         self.send_continue.connect(self.command_worker.continue_flow)
 
         self.send_command.connect(self.command_worker.set_command)
+        self.send_encoded_command.connect(self.command_worker.set_encoded_command)
         self.open_uart_connection.connect(self.command_worker.open_uart)
 
         self.command_worker.send_log.connect(self.write_log)
@@ -170,11 +539,10 @@ class MainController(QtWidgets.QMainWindow):
 
     def send_move_command(self):
         # command = 'MoveStnX	20	x	x	x	x	x	x	x	x	x	x	x	x	x	x	x'
-        command = 'MoveStnX\t20\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx'
-        self.send_command.emit(command)
+        self.send_encoded_command.emit(commands['MoveStnX'].encode(20))
 
     def send_home_command(self):
-        self.send_command.emit('home')
+        self.send_encoded_command.emit(commands['home'].encode())
 
     def open_uart(self):
         port = self.ui.ports_combobox.currentText()
@@ -183,7 +551,34 @@ class MainController(QtWidgets.QMainWindow):
         self.open_uart_connection.emit(port)
 
     def write_log(self, message: str):
-        self.ui.log_list.addItem(message)
+        self.log_model.append(message)
+
+    def get_latency_report(self, name: str = None):
+        '''
+        各指令在排隊, 傳輸與韌體所花的時間分布 (ns)
+        '''
+        return self.command_worker.tracer.report(name)
+
+    def get_queue_depths(self):
+        '''
+        各 CommandLevelEnum 尚未送出的指令數量
+        '''
+        return self.command_worker.queue_depths()
+
+    def get_emergency_latency(self):
+        '''
+        緊急指令從按下按鈕到寫出 serial 的時間分布 (ns)
+        '''
+        return self.command_worker.emergency_latency.summary()
+
+    def request_status(self, key: str):
+        '''
+        結果由 command_worker.status_ready 在 GUI 執行緒送出
+        '''
+        return self.command_worker.request_status(key)
+
+    def get_status_stats(self):
+        return self.command_worker.status_cache.stats()
 
     def start_process(self):
         count = self.ui.command_list.count()
@@ -193,10 +588,21 @@ class MainController(QtWidgets.QMainWindow):
             command = self.ui.command_list.currentItem().text()
             self.send_command.emit(command)
 
-    def get_com_ports(self):
-        self.ui.ports_combobox.clear()
-        self.com_ports = [port.name for port in list_ports.comports()]
-        self.ui.ports_combobox.addItems(self.com_ports)
+    def start_file(self, path: str):
+        '''
+        直接由檔案逐行執行腳本, 不載入 command_list
+        '''
+        self.write_log(f'start file: {path}')
+        self.command_worker.set_command_source(FileFlowSource(path))
+
+    def update_com_ports(self, added: list, removed: list):
+        apply_port_changes(self.ui.ports_combobox, added, removed)
+        self.com_ports = self.port_discovery.ports()
+
+    def closeEvent(self, event):
+        # 結束 discovery 執行緒並關閉 inotify
+        self.port_discovery.stop()
+        super().closeEvent(event)
 
 
 if __name__ == '__main__':
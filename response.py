@@ -0,0 +1,73 @@
+import re
+from enum import IntEnum
+from collections import namedtuple
+
+
+class ResponseKind(IntEnum):
+    UNKNOWN = 0
+    ACK = 1
+    FLOW_DONE = 2
+    SUSPEND = 3
+    ERROR = 4
+    PROTOCOL = 5
+    STATUS = 6
+
+
+Response = namedtuple('Response', ['kind', 'payload', 'fields'])
+'''
+kind: ResponseKind
+payload: 去掉前綴與換行後的內容, 與輸入同型別 (bytes 或 memoryview)
+fields: payload 中的整數
+'''
+
+PREFIXES = [
+    (b'ack', ResponseKind.ACK),
+    (b'flowdone', ResponseKind.FLOW_DONE),
+    (b'suspend', ResponseKind.SUSPEND),
+    (b'error', ResponseKind.ERROR),
+    (b'proto', ResponseKind.PROTOCOL),
+    (b'status', ResponseKind.STATUS),
+]
+
+NUMBER_PATTERN = re.compile(rb'-?\d+')
+
+
+def build_dispatch():
+    '''
+    以第一個 byte (不分大小寫) 查表, 只比對可能的前綴
+    '''
+    dispatch = [()] * 256
+    for prefix, kind in PREFIXES:
+        for first in {prefix[0], ord(chr(prefix[0]).upper())}:
+            dispatch[first] += ((prefix, kind),)
+    return dispatch
+
+
+DISPATCH = build_dispatch()
+
+
+def line_end(line):
+    end = len(line)
+    while end > 0 and line[end - 1] in (10, 13):
+        end -= 1
+    return end
+
+
+def classify(line) -> Response:
+    '''
+    直接在 bytes / memoryview 上判斷回應種類, 不轉成 str
+    '''
+    end = line_end(line)
+    if end == 0:
+        return Response(ResponseKind.UNKNOWN, line[:0], ())
+
+    for prefix, kind in DISPATCH[line[0]]:
+        size = len(prefix)
+        if end >= size and bytes(line[:size]).lower() == prefix:
+            payload = line[size:end]
+            fields = ()
+            if size < end:
+                fields = tuple(int(number) for number in NUMBER_PATTERN.findall(payload))
+            return Response(kind, payload, fields)
+
+    return Response(ResponseKind.UNKNOWN, line[:end], ())
@@ -0,0 +1,202 @@
+import sys
+import time
+import asyncio
+import argparse
+import collections
+
+from flow_source import FileFlowSource
+from checkpoint import CHECKPOINT_SUFFIX
+from flow_state import FlowState
+from response import ResponseKind, Response, classify
+from traffic_capture import TrafficRecorder
+
+
+EXIT_OK = 0
+EXIT_FIRMWARE_ERROR = 1
+EXIT_PORT_ERROR = 2
+EXIT_TIMEOUT = 3
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def run_qt(args) -> int:
+    '''
+    只使用 QtCore 與 QtSerialPort, 所有 worker 在主執行緒的 event loop 執行
+    '''
+    from PySide6 import QtCore
+    from engine import CommandWorker, FlowWorker
+
+    app = QtCore.QCoreApplication(sys.argv[:1])
+    result = {'code': EXIT_OK, 'steps': 0}
+
+    command_worker = CommandWorker()
+    command_worker.set_binary(args.binary)
+    if args.record:
+        command_worker.set_recorder(TrafficRecorder(args.record))
+    flow_worker = FlowWorker()
+    flow_worker.set_window(args.window)
+    flow_worker.set_command_source(FileFlowSource(args.recipe))
+    if args.checkpoint:
+        flow_worker.set_checkpoint(args.recipe + CHECKPOINT_SUFFIX, args.resume)
+
+    if args.verbose:
+        command_worker.send_log.connect(log)
+        flow_worker.send_log.connect(log)
+
+    def finish(code: int):
+        result['code'] = code
+        app.quit()
+
+    def port_error(message: str):
+        # 開啟失敗, 或執行中被拔除 (QSerialPort.errorOccurred)
+        log(f'port error: {message}')
+        finish(EXIT_PORT_ERROR)
+
+    def count_step(sequence: int):
+        result['steps'] += 1
+
+    def check_responses(responses: list):
+        # 在 FlowWorker 處理完同一批回應之後執行
+        for response in responses:
+            if not isinstance(response, Response):
+                response = classify(response)
+            if response.kind == ResponseKind.ERROR:
+                log(f'firmware error: {bytes(response.payload)!r}')
+                finish(EXIT_FIRMWARE_ERROR)
+                return
+        if flow_worker.is_finished():
+            finish(EXIT_OK)
+
+    flow_worker.send_command.connect(command_worker.send_command)
+    command_worker.receive_responses.connect(flow_worker.process_responses)
+    command_worker.receive_responses.connect(check_responses)
+    flow_worker.step_done.connect(count_step)
+    command_worker.port_error.connect(port_error)
+
+    command_worker.open_uart(args.port)
+    if command_worker.serial is None or not command_worker.serial.isOpen():
+        # port_error 已記錄原因, 保留 checkpoint
+        flow_worker.do_terminate()
+        return EXIT_PORT_ERROR
+
+    if args.timeout > 0:
+        QtCore.QTimer.singleShot(int(args.timeout * 1000), lambda: finish(EXIT_TIMEOUT))
+
+    start = time.perf_counter()
+    flow_worker.start_flow()
+    if flow_worker.is_finished():
+        # 空腳本或 checkpoint 已完成
+        flow_worker.do_terminate()
+        return EXIT_OK
+    app.exec()
+    flow_worker.do_terminate()
+    command_worker.serial.close()
+    if command_worker.recorder is not None:
+        command_worker.recorder.close()
+    log(f'steps: {result["steps"]} elapsed: {time.perf_counter() - start:.3f} s')
+    return result['code']
+
+
+async def run_asyncio_flow(args) -> int:
+    '''
+    不匯入 Qt, 以 AsyncSerialPort 執行腳本
+    '''
+    from async_serial import AsyncSerialPort, FirmwareError
+
+    state = FlowState(FileFlowSource(args.recipe), args.window)
+    if args.checkpoint and state.set_checkpoint(args.recipe + CHECKPOINT_SUFFIX, args.resume):
+        log(f'resume from step {state.current_line}')
+
+    # 與 state.in_flight 同樣順序的 send task
+    tasks = collections.deque()
+    start = time.perf_counter()
+    code = EXIT_OK
+    # 只有整個腳本完成才移除 checkpoint
+    finished = False
+
+    async def complete_oldest():
+        lines = await tasks.popleft()
+        state.complete()
+        if args.verbose:
+            log(f'step {state.current_line}: {lines}')
+
+    recorder = TrafficRecorder(args.record) if args.record else None
+    try:
+        port = AsyncSerialPort(args.port, window=args.window, recorder=recorder)
+        try:
+            await port.open()
+        except OSError as error:
+            log(f'cannot open {args.port}: {error}')
+            return EXIT_PORT_ERROR
+
+        try:
+            while not state.finished():
+                # window 滿或 dependent 指令時等最早的指令完成
+                record = state.next_record()
+                if record is None:
+                    await complete_oldest()
+                    continue
+                tasks.append(asyncio.ensure_future(port.send(record.command)))
+            finished = True
+        except FirmwareError as error:
+            log(f'firmware error: {error}')
+            code = EXIT_FIRMWARE_ERROR
+        except OSError as error:
+            # port 被拔除或關閉, ConnectionError 也是 OSError
+            log(f'port error: {error}')
+            code = EXIT_PORT_ERROR
+        except asyncio.CancelledError:
+            # wait_for 逾時, 由 run_asyncio 回傳 EXIT_TIMEOUT
+            code = EXIT_TIMEOUT
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            port.close()
+    finally:
+        steps = state.current_line
+        # 失敗, 逾時或例外時保留 checkpoint 供 resume
+        state.close(remove=finished)
+        if recorder is not None:
+            recorder.close()
+
+    log(f'steps: {steps} elapsed: {time.perf_counter() - start:.3f} s')
+    return code
+
+
+def run_asyncio(args) -> int:
+    try:
+        return asyncio.run(asyncio.wait_for(run_asyncio_flow(args), args.timeout or None))
+    except asyncio.TimeoutError:
+        log('timeout')
+        return EXIT_TIMEOUT
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='run a recipe on a serial port without the GUI')
+    parser.add_argument('recipe')
+    parser.add_argument('--port', required=True)
+    parser.add_argument('--backend', choices=['qt', 'asyncio'], default='qt')
+    parser.add_argument('--window', type=int, default=1, help='commands in flight, 1 waits for each FlowDone')
+    parser.add_argument('--binary', action='store_true', help='negotiate binary framing (qt backend)')
+    parser.add_argument('--checkpoint', action='store_true', help='write recipe.checkpoint after every step')
+    parser.add_argument('--resume', action='store_true', help='continue from recipe.checkpoint')
+    parser.add_argument('--record', help='write every serial read and write to this capture file')
+    parser.add_argument('--timeout', type=float, default=0, help='seconds, 0 waits forever')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.resume:
+        args.checkpoint = True
+    if args.binary and args.backend != 'qt':
+        parser.error('--binary is only supported by the qt backend')
+
+    if args.backend == 'asyncio':
+        return run_asyncio(args)
+    return run_qt(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
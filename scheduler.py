@@ -0,0 +1,104 @@
+import threading
+import collections
+
+
+class CommandHandle(object):
+    '''
+    排入 CommandScheduler 的指令, 可用來取消
+    '''
+    __slots__ = ('level', 'item', 'generation', 'state')
+
+    QUEUED = 0
+    TAKEN = 1
+    CANCELLED = 2
+
+    def __init__(self, level, item, generation: int):
+        self.level = level
+        self.item = item
+        self.generation = generation
+        self.state = self.QUEUED
+
+
+class CommandScheduler(object):
+    '''
+    每個 level 一個 deque, 同一個 level 內先進先出, 數值小的 level 先取出
+    取消只標記 handle, 取出時略過; flush 直接換掉 deque 並遞增 generation
+    兩者都是 O(1)
+    '''
+
+    def __init__(self, levels):
+        self.levels = sorted(levels)
+        self.queues = {level: collections.deque() for level in self.levels}
+        self.counts = {level: 0 for level in self.levels}
+        # flush 後舊的 handle generation 不同, 視為已被清除
+        self.generations = {level: 0 for level in self.levels}
+        self.ready = threading.Condition()
+
+    def put(self, level, item) -> CommandHandle:
+        with self.ready:
+            handle = CommandHandle(level, item, self.generations[level])
+            self.queues[level].append(handle)
+            self.counts[level] += 1
+            self.ready.notify()
+        return handle
+
+    def is_queued(self, handle: CommandHandle):
+        return handle.state == CommandHandle.QUEUED and \
+            handle.generation == self.generations[handle.level]
+
+    def cancel(self, handle: CommandHandle):
+        with self.ready:
+            if not self.is_queued(handle):
+                return False
+            handle.state = CommandHandle.CANCELLED
+            self.counts[handle.level] -= 1
+            return True
+
+    def flush(self, level=None):
+        '''
+        清除指定 level 或全部 level, 回傳清除的數量
+        '''
+        levels = self.levels if level is None else [level]
+        with self.ready:
+            flushed = 0
+            for level in levels:
+                flushed += self.counts[level]
+                self.queues[level] = collections.deque()
+                self.counts[level] = 0
+                self.generations[level] += 1
+            return flushed
+
+    def depth(self, level=None):
+        if level is None:
+            return sum(self.counts.values())
+        return self.counts[level]
+
+    def depths(self):
+        with self.ready:
+            return dict(self.counts)
+
+    def pop(self, levels=None):
+        '''
+        不等待, 依優先順序取出一筆, 沒有指令時回傳 None
+        '''
+        with self.ready:
+            for level in self.levels if levels is None else levels:
+                if self.counts[level] == 0:
+                    continue
+                commands = self.queues[level]
+                while True:
+                    handle = commands.popleft()
+                    if handle.state == CommandHandle.QUEUED:
+                        handle.state = CommandHandle.TAKEN
+                        self.counts[level] -= 1
+                        return handle
+            return None
+
+    def get(self, timeout=None):
+        '''
+        等待直到有指令可以取出, 超過 timeout 回傳 None
+        '''
+        with self.ready:
+            if not self.ready.wait_for(self.depth, timeout):
+                return None
+            return self.pop()
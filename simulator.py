@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+import tty
+import time
+import queue
+import random
+import select
+import argparse
+import threading
+
+from framing import FrameDecoder, FRAME_TIMEOUT, decode_line, encode_line_frame
+
+
+SUSPEND_PATTERN = re.compile(rb'suspend\[(\d+)\]', re.IGNORECASE)
+PROTOCOL_PATTERN = re.compile(rb'proto\[(\d+)\]', re.IGNORECASE)
+STATUS_PATTERN = re.compile(rb'status\[(.*)\]', re.IGNORECASE)
+
+
+class FirmwareSimulator(object):
+    '''
+    以 pseudo-terminal 模擬韌體
+    一般指令回傳 ack 與 FlowDone, suspend[n] 立即回傳 suspend[n], status[key] 立即回傳一行 status
+    binary 為 True 時接受 proto[1] 協商, 之後的指令與回應都是 frame, 否則回傳 error
+    port 為 slave 端的路徑, 可以直接傳給 open_uart
+    '''
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 flow_time: float = 0.0,
+                 burst: int = 0,
+                 error_rate: float = 0.0,
+                 drop_rate: float = 0.0,
+                 binary: bool = False,
+                 seed=None):
+        # 收到指令到回傳 ack 的時間 (秒)
+        self.latency = latency
+        # latency 與 flow_time 隨機增減的範圍 (秒)
+        self.jitter = jitter
+        # ack 到 FlowDone 的時間 (秒)
+        self.flow_time = flow_time
+        # FlowDone 前一次寫出的額外訊息行數
+        self.burst = burst
+        # 以 error 取代 ack 且不回傳 FlowDone 的機率
+        self.error_rate = error_rate
+        # 回傳 ack 但不回傳 FlowDone 的機率
+        self.drop_rate = drop_rate
+        self.binary = binary
+        self.random = random.Random(seed)
+        # 協商完成後改為 frame
+        self.decoder = None
+
+        self.master = None
+        self.slave = None
+        self.port = None
+
+        self.command_queue = queue.Queue()
+        self.resumed = threading.Event()
+        self.resumed.set()
+        # 打斷 read_loop 的 select, 每次 start 重新建立
+        self.stop_reader = None
+        self.stop_writer = None
+        self.threads = []
+        self.running = False
+
+        self.received = 0
+        self.completed = 0
+        self.write_lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        # raw mode: 不回顯也不轉換換行
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.stop_reader, self.stop_writer = os.pipe()
+        self.decoder = None
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.read_loop, name='simulator-reader', daemon=True),
+            threading.Thread(target=self.execute_loop, name='simulator-executor', daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self.port
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        os.write(self.stop_writer, b'\0')
+        self.command_queue.put(None)
+        self.resumed.set()
+        for thread in self.threads:
+            thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+        os.close(self.stop_reader)
+        os.close(self.stop_writer)
+        self.stop_reader = None
+        self.stop_writer = None
+
+    def write(self, data: bytes):
+        with self.write_lock:
+            if self.decoder is not None:
+                data = b''.join(encode_line_frame(line) for line in data.splitlines())
+            os.write(self.master, data)
+
+    def delay(self, base: float):
+        value = base + self.random.uniform(-self.jitter, self.jitter)
+        if value > 0:
+            time.sleep(value)
+
+    def read_loop(self):
+        buffer = bytearray()
+        while self.running:
+            # 收到不完整的 frame 時逾時捨棄, 與主機端的 decoder 相同
+            decoder = self.decoder
+            timeout = FRAME_TIMEOUT if decoder is not None and decoder.pending() else None
+            readable, _, _ = select.select([self.master, self.stop_reader], [], [], timeout)
+            if self.stop_reader in readable:
+                return
+            if not readable:
+                for opcode, payload in decoder.expire():
+                    self.receive(decode_line(opcode, payload).rstrip(b'\r\n'))
+                continue
+            try:
+                buffer += os.read(self.master, 4096)
+            except OSError:
+                return
+
+            while self.decoder is None:
+                end = buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buffer[:end]).rstrip(b'\r')
+                del buffer[:end + 1]
+                if len(line) > 0:
+                    self.receive(line)
+
+            if self.decoder is not None:
+                for opcode, payload in self.decoder.feed(buffer):
+                    self.receive(decode_line(opcode, payload).rstrip(b'\r\n'))
+                buffer.clear()
+
+    def receive(self, line: bytes):
+        match = PROTOCOL_PATTERN.fullmatch(line)
+        if match is not None:
+            self.negotiate(int(match.group(1)))
+            return
+
+        self.received += 1
+        match = STATUS_PATTERN.fullmatch(line)
+        if match is not None:
+            self.write(b'status %s %s\r\n' % (match.group(1), b'paused' if not self.resumed.is_set() else b'idle'))
+            return
+
+        match = SUSPEND_PATTERN.fullmatch(line)
+        if match is None:
+            self.command_queue.put(line)
+            return
+
+        # 緊急指令不排隊, 直接回應
+        level = int(match.group(1))
+        if level == 1:
+            self.resumed.clear()
+        elif level == 2:
+            self.clear_queue()
+            self.resumed.set()
+        else:
+            self.resumed.set()
+        self.write(b'suspend[%d]\r\n' % level)
+
+    def negotiate(self, protocol: int):
+        if not self.binary or protocol != 1:
+            self.write(b'error\r\n')
+            return
+        # 以文字回應後才切換, 之後的讀寫都是 frame
+        with self.write_lock:
+            os.write(self.master, b'proto[%d]\r\n' % protocol)
+            self.decoder = FrameDecoder()
+
+    def clear_queue(self):
+        try:
+            while True:
+                self.command_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def execute_loop(self):
+        sequence = 0
+        while self.running:
+            command = self.command_queue.get()
+            if command is None:
+                return
+            self.resumed.wait()
+
+            self.delay(self.latency)
+            if self.random.random() < self.error_rate:
+                self.write(b'error\r\n')
+                continue
+            self.write(b'ack\r\n')
+
+            self.delay(self.flow_time)
+            if self.random.random() < self.drop_rate:
+                continue
+
+            # burst 的訊息與 FlowDone 一起寫出, 模擬韌體短時間回傳多筆
+            lines = []
+            for i in range(self.burst):
+                sequence += 1
+                lines.append(b'log[%d]\r\n' % sequence)
+            lines.append(b'FlowDone\r\n')
+            self.write(b''.join(lines))
+            self.completed += 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pty firmware simulator')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--flow-time', type=float, default=0.0)
+    parser.add_argument('--burst', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--binary', action='store_true')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    simulator = FirmwareSimulator(
+        latency=args.latency,
+        jitter=args.jitter,
+        flow_time=args.flow_time,
+        burst=args.burst,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        binary=args.binary,
+        seed=args.seed,
+    )
+    with simulator:
+        print(simulator.port, flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    sys.exit(0)
@@ -0,0 +1,100 @@
+import time
+import threading
+from concurrent.futures import Future
+
+
+STATUS_TTL = 1.0
+'''
+狀態查詢結果的有效時間 (秒)
+'''
+
+
+class StatusCache(object):
+    '''
+    以 key 快取狀態查詢的結果
+    TTL 內直接回傳快取; 同一個 key 已在查詢中時共用同一個 future, 只送出一次指令
+    可以在任何執行緒呼叫
+    '''
+
+    def __init__(self, ttl: float = STATUS_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key: (value, 到期時間)
+        self.entries = {}
+        # key: 查詢中的 future
+        self.in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def lookup(self, key: str):
+        '''
+        回傳 (future, issue)
+        issue 為 True 時呼叫端必須送出查詢, 並以 resolve / fail 完成
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                self.hits += 1
+                future = Future()
+                future.set_result(entry[0])
+                return future, False
+
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+
+            self.misses += 1
+            future = Future()
+            self.in_flight[key] = future
+            return future, True
+
+    def get(self, key: str, default=None):
+        '''
+        只讀取未過期的快取, 不送出查詢
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                return entry[0]
+            return default
+
+    def resolve(self, key: str, value):
+        with self.lock:
+            self.entries[key] = (value, self.clock() + self.ttl)
+            future = self.in_flight.pop(key, None)
+        # callback 不在 lock 內執行
+        if future is not None:
+            future.set_result(value)
+
+    def fail(self, key: str, error: BaseException):
+        with self.lock:
+            future = self.in_flight.pop(key, None)
+        if future is not None:
+            future.set_exception(error)
+
+    def cancel(self, key: str):
+        with self.lock:
+            future = self.in_flight.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def invalidate(self, key: str = None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.in_flight),
+                'entries': len(self.entries),
+            }
@@ -0,0 +1,201 @@
+import time
+import threading
+from concurrent.futures import Future
+
+from PySide6 import QtCore
+from coalesce import BatchCoalescer
+
+
+class Task(QtCore.QRunnable):
+    '''
+    在 QThreadPool 執行 function, 結果與例外寫入 future
+    '''
+
+    def __init__(self, future: Future, function, args=(), kwargs=None, monitor=None):
+        super().__init__()
+        self.future = future
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs or {}
+        # 紀錄排隊與執行時間的 TaskPool
+        self.monitor = monitor
+        self.submitted = time.perf_counter()
+
+    def run(self):
+        started = time.perf_counter()
+        if self.monitor is not None:
+            self.monitor.task_started(started - self.submitted)
+        try:
+            # 已被取消的 future 不執行
+            if not self.future.set_running_or_notify_cancel():
+                return
+            try:
+                result = self.function(*self.args, **self.kwargs)
+            except BaseException as error:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        finally:
+            if self.monitor is not None:
+                self.monitor.task_finished(time.perf_counter() - started)
+
+
+class CompletionDispatcher(BatchCoalescer):
+    '''
+    收集 pool 執行緒完成的 future
+    每 interval ms 最多一次, 在 dispatcher 所在的執行緒 (GUI) 批次執行 callback
+    '''
+
+    def __init__(self, interval: int = 16, parent=None):
+        super().__init__(interval, parent)
+
+    def post(self, callback, future: Future):
+        '''
+        可以在任何執行緒呼叫, 每一批只送出一次跨執行緒的 signal
+        '''
+        self.push((callback, future))
+
+    def deliver(self, completed: list):
+        for callback, future in completed:
+            callback(future)
+
+
+class TaskPool(QtCore.QObject):
+    '''
+    以 future 包裝 QThreadPool.globalInstance(), 不需要為每個工作撰寫 QRunnable
+    '''
+
+    def __init__(self, pool: QtCore.QThreadPool = None, interval: int = 16, parent=None):
+        super().__init__(parent)
+        self.pool = pool or QtCore.QThreadPool.globalInstance()
+        self.dispatcher = CompletionDispatcher(interval, self)
+
+        # 給 PoolGovernor 取樣的統計, 時間單位為秒
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    def start(self, task: Task, priority: int = 0):
+        with self.lock:
+            self.pending += 1
+        self.pool.start(task, priority)
+
+    def task_started(self, wait: float):
+        with self.lock:
+            self.pending -= 1
+            # 指數移動平均, 反應最近的排隊時間
+            self.wait_time += (wait - self.wait_time) * 0.2
+
+    def task_finished(self, duration: float):
+        with self.lock:
+            self.completed += 1
+            self.run_time += (duration - self.run_time) * 0.2
+
+    def submit(self, function, *args, priority: int = 0, **kwargs) -> Future:
+        '''
+        priority 越大越先執行
+        '''
+        future = Future()
+        self.start(Task(future, function, args, kwargs, self), priority)
+        return future
+
+    def then(self, future: Future, function, priority: int = 0) -> Future:
+        '''
+        future 成功後以其結果在 pool 執行 function, 失敗或取消會傳遞到回傳的 future
+        '''
+        next_future = Future()
+
+        def chain(done: Future):
+            if done.cancelled():
+                next_future.cancel()
+            elif done.exception() is not None:
+                next_future.set_exception(done.exception())
+            else:
+                self.start(Task(next_future, function, (done.result(),), monitor=self), priority)
+
+        future.add_done_callback(chain)
+        return next_future
+
+    def on_done(self, future: Future, callback):
+        '''
+        callback(future) 在 TaskPool 所在的執行緒 (GUI) 執行
+        '''
+        future.add_done_callback(lambda done: self.dispatcher.post(callback, done))
+        return future
+
+
+class PoolGovernor(QtCore.QObject):
+    '''
+    定期取樣 TaskPool 的排隊數量, 排隊時間與 activeThreadCount
+    有積壓時在 minimum / maximum 之間增加 maxThreadCount
+    閒置時逐步縮回 baseline (idealThreadCount), 並縮短 expiryTimeout 讓閒置的執行緒儘快回收
+    '''
+    send_metrics = QtCore.Signal(dict)
+
+    def __init__(self,
+                 task_pool: TaskPool,
+                 minimum: int = 1,
+                 maximum: int = None,
+                 min_expiry: int = 1000,
+                 max_expiry: int = 30000,
+                 target_wait: float = 0.05,
+                 interval: int = 500,
+                 parent=None):
+        super().__init__(parent)
+        self.task_pool = task_pool
+        self.pool = task_pool.pool
+        self.minimum = max(1, minimum)
+        # idealThreadCount 已是 QThreadPool 預設的 maxThreadCount
+        # 預設上限為其 4 倍, 會阻塞的工作積壓時才有空間增加執行緒
+        self.maximum = max(self.minimum, maximum or QtCore.QThread.idealThreadCount() * 4)
+        # 閒置時縮回的數量, 之後的 CPU 工作不會超過核心數
+        self.baseline = min(self.maximum, max(self.minimum, QtCore.QThread.idealThreadCount()))
+        self.min_expiry = min_expiry
+        self.max_expiry = max_expiry
+        # 平均排隊時間超過此值 (秒) 視為需要更多執行緒
+        self.target_wait = target_wait
+        self.metrics = {}
+
+        self.sample_timer = QtCore.QTimer(self)
+        self.sample_timer.setInterval(interval)
+        self.sample_timer.timeout.connect(self.sample)
+        self.sample_timer.start()
+
+    def sample(self):
+        with self.task_pool.lock:
+            pending = self.task_pool.pending
+            wait_time = self.task_pool.wait_time
+            run_time = self.task_pool.run_time
+            completed = self.task_pool.completed
+        active = self.pool.activeThreadCount()
+        current = self.pool.maxThreadCount()
+
+        target = current
+        expiry = self.pool.expiryTimeout()
+        if pending > 0 and (active >= current or wait_time > self.target_wait):
+            # 有積壓: 依排隊數量增加執行緒, 並保留閒置的執行緒
+            target = current + pending
+            expiry = self.max_expiry
+        elif pending == 0 and active < current:
+            # 閒置: 每次取樣縮小一半的差距, 短暫的空檔不會一次縮回
+            target = max(self.baseline, active, (current + self.baseline) // 2)
+            expiry = self.min_expiry
+
+        target = min(self.maximum, max(self.minimum, target))
+        if target != current:
+            self.pool.setMaxThreadCount(target)
+        if expiry != self.pool.expiryTimeout():
+            self.pool.setExpiryTimeout(expiry)
+
+        self.metrics = {
+            'pending': pending,
+            'active': active,
+            'max_threads': target,
+            'expiry_timeout': expiry,
+            'wait_time': wait_time,
+            'run_time': run_time,
+            'completed': completed,
+        }
+        self.send_metrics.emit(self.metrics)
@@ -0,0 +1,63 @@
+import os
+
+from checkpoint import CheckpointJournal, HEADER, RECORD
+
+
+def test_load_missing(tmp_path):
+    assert CheckpointJournal.load(str(tmp_path / 'missing'), 10) is None
+
+
+def test_append_and_load(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    journal = CheckpointJournal(path, 100)
+    assert CheckpointJournal.load(path, 100) == (0, 0)
+    for step in range(1, 6):
+        journal.append(step, step * 10)
+    journal.close()
+    assert CheckpointJournal.load(path, 100) == (5, 50)
+    # 腳本大小不同代表腳本被修改
+    assert CheckpointJournal.load(path, 101) is None
+
+
+def test_truncated_record(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    journal = CheckpointJournal(path, 100)
+    journal.append(1, 10)
+    journal.append(2, 20)
+    journal.close()
+    with open(path, 'ab') as file:
+        file.write(RECORD.pack(3, 30)[:5])
+
+    assert CheckpointJournal.load(path, 100) == (2, 20)
+    journal = CheckpointJournal(path, 100, resume=True)
+    assert os.path.getsize(path) == HEADER.size + 2 * RECORD.size
+    journal.append(3, 30)
+    journal.close()
+    assert CheckpointJournal.load(path, 100) == (3, 30)
+
+
+def test_without_resume_clears(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    journal = CheckpointJournal(path, 100)
+    journal.append(1, 10)
+    journal.close()
+    CheckpointJournal(path, 100).close()
+    assert CheckpointJournal.load(path, 100) == (0, 0)
+
+
+def test_resume_changed_recipe_restarts(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    journal = CheckpointJournal(path, 100)
+    journal.append(1, 10)
+    journal.close()
+    CheckpointJournal(path, 200, resume=True).close()
+    assert CheckpointJournal.load(path, 200) == (0, 0)
+
+
+def test_close_remove(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    journal = CheckpointJournal(path, 100)
+    journal.close(remove=True)
+    assert not os.path.exists(path)
+    # 重複 close 不會出錯
+    journal.close(remove=True)
@@ -0,0 +1,61 @@
+from flow_source import FileFlowSource, ListFlowSource
+
+
+def write_recipe(tmp_path, data: bytes):
+    path = tmp_path / 'recipe.txt'
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_list_source():
+    source = ListFlowSource(['a', 'b'])
+    assert source.peek() == ('a', 1)
+    assert list(source) == [('a', 1), ('b', 2)]
+    assert source.next() is None
+    assert source.percentage(1) == 50
+    source.seek(1)
+    assert source.next() == ('b', 2)
+
+
+def test_file_positions_are_byte_offsets(tmp_path):
+    path = write_recipe(tmp_path, b'home\r\n\r\nMoveStnX\t1\n  \nlast')
+    source = FileFlowSource(path)
+    items = list(source)
+    source.close()
+    # 空白行略過, position 為下一行開頭的 offset
+    assert items == [('home', 6), ('MoveStnX\t1', 19), ('last', 26)]
+    assert source.total == 26
+
+
+def test_seek_to_position(tmp_path):
+    path = write_recipe(tmp_path, b'a\nb\nc\n')
+    source = FileFlowSource(path)
+    first = source.next()
+    source.next()
+    source.seek(first[1])
+    assert source.next() == ('b', 4)
+    source.close()
+
+
+def test_lookahead_smaller_than_recipe(tmp_path):
+    lines = [f'step\t{index}' for index in range(100)]
+    path = write_recipe(tmp_path, ('\n'.join(lines) + '\n').encode())
+    source = FileFlowSource(path, lookahead=3)
+    assert source.peek()[0] == 'step\t0'
+    assert len(source.buffer) == 3
+    assert [command for command, _ in source] == lines
+    assert source.percentage(source.total) == 100
+    source.close()
+
+
+def test_empty_file(tmp_path):
+    source = FileFlowSource(write_recipe(tmp_path, b''))
+    assert source.peek() is None
+    assert source.percentage(0) == 100
+    source.close()
+
+
+def test_utf8(tmp_path):
+    source = FileFlowSource(write_recipe(tmp_path, '移動\n'.encode('utf8')))
+    assert source.next() == ('移動', 7)
+    source.close()
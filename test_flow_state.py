@@ -0,0 +1,92 @@
+import os
+
+from checkpoint import CheckpointJournal
+from flow_source import ListFlowSource
+from flow_state import FlowState
+
+
+def run(state: FlowState):
+    '''
+    window 滿或等待 dependent 指令時完成最早的指令, 回傳送出與完成的順序
+    '''
+    events = []
+    while not state.finished():
+        record = state.next_record()
+        if record is None:
+            events.append(('done', state.complete().command))
+        else:
+            events.append(('send', record.command))
+    return events
+
+
+def test_stop_and_wait_by_default():
+    state = FlowState(ListFlowSource(['a', 'b']))
+    assert run(state) == [('send', 'a'), ('done', 'a'), ('send', 'b'), ('done', 'b')]
+
+
+def test_window_pipelines():
+    state = FlowState(ListFlowSource(['a', 'b', 'c']), window=2)
+    assert run(state) == [
+        ('send', 'a'), ('send', 'b'), ('done', 'a'), ('send', 'c'), ('done', 'b'), ('done', 'c'),
+    ]
+
+
+def test_home_is_a_barrier():
+    state = FlowState(ListFlowSource(['a', 'home', 'b\t1', 'c']), window=4)
+    assert run(state) == [
+        ('send', 'a'), ('done', 'a'),
+        ('send', 'home'), ('done', 'home'),
+        ('send', 'b\t1'), ('send', 'c'), ('done', 'b\t1'), ('done', 'c'),
+    ]
+
+
+def test_ack_marks_oldest_unacked():
+    state = FlowState(ListFlowSource(['a', 'b']), window=2)
+    first = state.next_record()
+    second = state.next_record()
+    assert state.ack() is first
+    assert state.ack() is second
+    assert state.ack() is None
+
+
+def test_sequence_and_positions():
+    state = FlowState(ListFlowSource(['a', 'b']), window=2)
+    records = [state.next_record(), state.next_record()]
+    assert [(record.sequence, record.position) for record in records] == [(1, 1), (2, 2)]
+    assert state.percentage(records[0].position) == 50
+
+
+def test_checkpoint_removed_when_finished(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    state = FlowState(ListFlowSource(['a', 'b']))
+    assert not state.set_checkpoint(path)
+    run(state)
+    assert not os.path.exists(path)
+
+
+def test_checkpoint_kept_and_resumed(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    state = FlowState(ListFlowSource(['a', 'b', 'c']))
+    state.set_checkpoint(path)
+    state.next_record()
+    state.complete()
+    state.next_record()
+    # 中斷: b 尚未完成
+    state.close()
+    assert CheckpointJournal.load(path, 3) == (1, 1)
+
+    state = FlowState(ListFlowSource(['a', 'b', 'c']))
+    assert state.set_checkpoint(path, resume=True)
+    assert state.current_line == 1
+    assert run(state) == [('send', 'b'), ('done', 'b'), ('send', 'c'), ('done', 'c')]
+    assert state.current_line == 3
+    assert not os.path.exists(path)
+
+
+def test_close_remove(tmp_path):
+    path = str(tmp_path / 'recipe.checkpoint')
+    state = FlowState(ListFlowSource([]))
+    state.set_checkpoint(path)
+    assert state.finished()
+    state.close(remove=True)
+    assert not os.path.exists(path)
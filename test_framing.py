@@ -0,0 +1,114 @@
+from framing import (
+    FrameDecoder, MAX_PAYLOAD, OP_ACK, OP_FLOW_DONE, OP_HOME, OP_MOVE_STN_X, OP_TEXT,
+    SYNC, decode_line, encode_line_frame,
+)
+from response import ResponseKind
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_round_trip():
+    for line in [b'home', b'ack', b'FlowDone', b'suspend[2]', b'proto[1]', b'error 3',
+                 b'MoveStnX\t20\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\t-5', b'log[1] hello']:
+        frames = FrameDecoder().feed(encode_line_frame(line))
+        assert len(frames) == 1
+        assert decode_line(*frames[0]) == line + b'\r\n'
+
+
+def test_move_is_packed():
+    line = b'MoveStnX\t20' + b'\tx' * 15
+    frame = encode_line_frame(line)
+    assert frame[1] == OP_MOVE_STN_X
+    # mask + 一個 int32
+    assert frame[2] == 6
+
+
+def test_split_feed():
+    stream = encode_line_frame(b'ack') + encode_line_frame(b'FlowDone')
+    decoder = FrameDecoder()
+    frames = []
+    for index in range(len(stream)):
+        frames += decoder.feed(stream[index:index + 1])
+    assert frames == [(OP_ACK, b''), (OP_FLOW_DONE, b'')]
+    assert not decoder.pending()
+
+
+def test_crc_error_resyncs():
+    bad = bytearray(encode_line_frame(b'home'))
+    bad[-1] ^= 0xFF
+    decoder = FrameDecoder()
+    frames = decoder.feed(bytes(bad) + encode_line_frame(b'ack'))
+    assert frames == [(OP_ACK, b'')]
+    assert decoder.crc_errors == 1
+
+
+def test_garbage_before_frame():
+    decoder = FrameDecoder()
+    frames = decoder.feed(b'\x00\x01' + bytes((SYNC, 0x7F)) + encode_line_frame(b'home'))
+    assert frames == [(OP_HOME, b'')]
+
+
+def test_bad_length_of_bounded_opcode():
+    # ack 的長度只能是 0, 不必等待 0x80 個 byte
+    bad = bytearray(encode_line_frame(b'ack'))
+    bad[2] = 0x80
+    decoder = FrameDecoder()
+    assert decoder.feed(bytes(bad) + encode_line_frame(b'FlowDone')) == [(OP_FLOW_DONE, b'')]
+    assert not decoder.pending()
+
+
+def test_bad_length_of_text_expires():
+    clock = FakeClock()
+    bad = bytearray(encode_line_frame(b'hello'))
+    bad[2] = 0x80
+    decoder = FrameDecoder(timeout=0.1, clock=clock)
+    assert decoder.feed(bytes(bad) + encode_line_frame(b'FlowDone')) == []
+    assert decoder.pending()
+    assert decoder.expire() == []
+
+    clock.now = 0.2
+    assert decoder.expire() == [(OP_FLOW_DONE, b'')]
+    assert not decoder.pending()
+    assert decoder.timeouts == 1
+
+
+def test_stale_data_is_not_joined_with_new_data():
+    clock = FakeClock()
+    decoder = FrameDecoder(timeout=0.1, clock=clock)
+    assert decoder.feed(encode_line_frame(b'home')[:3]) == []
+    clock.now = 1.0
+    assert decoder.feed(encode_line_frame(b'ack')) == [(OP_ACK, b'')]
+
+
+def test_long_line_uses_continuation_frames():
+    line = bytes(range(32, 127)) * 8
+    stream = encode_line_frame(line)
+    assert len(line) > MAX_PAYLOAD
+    decoder = FrameDecoder()
+    frames = []
+    for index in range(0, len(stream), 7):
+        frames += decoder.feed(stream[index:index + 7])
+    assert frames == [(OP_TEXT, line)]
+
+
+def test_long_error_keeps_its_kind():
+    line = b'error ' + b'x' * 400
+    responses = FrameDecoder().feed_responses(encode_line_frame(line))
+    assert len(responses) == 1
+    assert responses[0].kind == ResponseKind.ERROR
+
+
+def test_reset_drops_partial_text():
+    line = b'y' * (MAX_PAYLOAD + 10)
+    stream = encode_line_frame(line)
+    decoder = FrameDecoder()
+    # 只送出第一個 OP_TEXT_PART
+    assert decoder.feed(stream[:MAX_PAYLOAD + 5]) == []
+    decoder.reset()
+    assert decoder.feed(encode_line_frame(b'short')) == [(OP_TEXT, b'short')]
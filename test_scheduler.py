@@ -0,0 +1,72 @@
+import threading
+
+from scheduler import CommandScheduler
+
+
+LEVELS = (1, 2, 3)
+
+
+def test_priority_and_fifo():
+    scheduler = CommandScheduler(LEVELS)
+    for item in ('a', 'b'):
+        scheduler.put(3, item)
+    scheduler.put(1, 'urgent')
+    scheduler.put(2, 'status')
+    assert [scheduler.pop().item for _ in range(4)] == ['urgent', 'status', 'a', 'b']
+    assert scheduler.pop() is None
+
+
+def test_pop_levels():
+    scheduler = CommandScheduler(LEVELS)
+    scheduler.put(3, 'normal')
+    assert scheduler.pop((1,)) is None
+    assert scheduler.pop().item == 'normal'
+
+
+def test_cancel():
+    scheduler = CommandScheduler(LEVELS)
+    first = scheduler.put(3, 'a')
+    scheduler.put(3, 'b')
+    assert scheduler.cancel(first)
+    assert not scheduler.cancel(first)
+    assert scheduler.depth() == 1
+    assert scheduler.pop().item == 'b'
+    assert scheduler.depth() == 0
+
+
+def test_cancel_taken_handle():
+    scheduler = CommandScheduler(LEVELS)
+    handle = scheduler.put(3, 'a')
+    assert scheduler.pop() is handle
+    assert not scheduler.cancel(handle)
+
+
+def test_flush_generation():
+    scheduler = CommandScheduler(LEVELS)
+    old = scheduler.put(3, 'old')
+    scheduler.put(1, 'urgent')
+    assert scheduler.flush(3) == 1
+    assert scheduler.depths() == {1: 1, 2: 0, 3: 0}
+    # flush 之前的 handle 不再能取消, 也不影響數量
+    assert not scheduler.is_queued(old)
+    assert not scheduler.cancel(old)
+    scheduler.put(3, 'new')
+    assert scheduler.flush() == 2
+    assert scheduler.depth() == 0
+    assert scheduler.pop() is None
+
+
+def test_get_timeout():
+    scheduler = CommandScheduler(LEVELS)
+    assert scheduler.get(timeout=0.01) is None
+
+
+def test_get_waits_for_put():
+    scheduler = CommandScheduler(LEVELS)
+    timer = threading.Timer(0.05, scheduler.put, (2, 'status'))
+    timer.start()
+    try:
+        handle = scheduler.get(timeout=5)
+    finally:
+        timer.join()
+    assert handle.item == 'status'
@@ -1,30 +1,99 @@
 from concurrent.futures import thread
 from PySide6 import QtWidgets
-from PySide6.QtCore import QThread, QThreadPool, QObject, QTimer, Signal
+from PySide6.QtCore import QThread, QThreadPool, QObject, QTimer, Signal, Slot
 import threading
 import time, random
 
 # print(QThread.idealThreadCount()) # 取得當前硬體最佳的執行緒數量
 
 class Worker(QObject):
+    # 由 GUI thread emit, 只會排進這個 worker 的 thread
+    requested = Signal(str)
+    done = Signal(int)
+
     work = ''
+
+    def __init__(self, index: int):
+        super().__init__()
+        self.index = index
+        self.requested.connect(self.do_work)
+
+    @Slot(str)
     def do_work(self, work):
         print(f'thread[{threading.current_thread().name}]: {threading.get_ident()} do work', flush=True)
         self.work = work
         self.run()
+        self.done.emit(self.index)
     def run(self):
         print(f'thread[{threading.current_thread().name}]: {threading.get_ident()} actived', flush=True)
         # time.sleep(random.randint(1, 3))
         # self.run()
 
 
+class WorkerPool(QObject):
+    '''
+    固定上限的長駐 QThread 與 Worker
+    每個事件只送給一個 worker (round robin 或目前工作最少的 worker)
+    '''
+
+    def __init__(self, size: int = QThread.idealThreadCount(), least_loaded: bool = True):
+        super().__init__()
+        self.size = max(1, size)
+        self.least_loaded = least_loaded
+        self.worker_list = []
+        self.thread_list = []
+        # 每個 worker 尚未完成的事件數量
+        self.loads = []
+        self.next_index = 0
+
+    def grow(self):
+        if len(self.worker_list) >= self.size:
+            return False
+        index = len(self.worker_list)
+        # Worker 與 Thread 都必須有參照才能執行
+        worker = Worker(index)
+        thread = QThread()
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.done.connect(self.complete)
+
+        self.worker_list.append(worker)
+        self.thread_list.append(thread)
+        self.loads.append(0)
+        thread.start()
+        return True
+
+    def dispatch(self, work: str):
+        if len(self.worker_list) == 0:
+            self.grow()
+
+        if self.least_loaded:
+            # worker 數量上限為 size, 掃描的成本固定
+            index = min(range(len(self.loads)), key=self.loads.__getitem__)
+        else:
+            index = self.next_index % len(self.worker_list)
+            self.next_index += 1
+
+        self.loads[index] += 1
+        self.worker_list[index].requested.emit(work)
+
+    @Slot(int)
+    def complete(self, index: int):
+        self.loads[index] -= 1
+
+    def shutdown(self):
+        # 確保 thread 任務執行完成後才退出
+        for thread in self.thread_list:
+            thread.quit()
+        for thread in self.thread_list:
+            thread.wait()
+
+
 class Window(QtWidgets.QWidget):
-    do_work = Signal(str)
-    worker_list = []
-    thread_list = []
-    
+
     def __init__(self):
         super().__init__()
+        self.pool = WorkerPool()
         vbox = QtWidgets.QVBoxLayout()
         self.main_thread_label = QtWidgets.QLabel(f'Main Thread: {threading.current_thread().getName()} {threading.get_ident()}')
 
@@ -53,8 +122,8 @@ class Window(QtWidgets.QWidget):
         # 在主執行緒執行會沒有效果
         # self.worker_list[random.randint(0, total - 1)].do_work('event')
 
-        # 使用 signal-slot 才會進入 thread 執行
-        self.do_work.emit('event')
+        # 使用 signal-slot 才會進入 thread 執行, 每個事件只交給一個 worker
+        self.pool.dispatch('event')
 
 
     def active_thread_count(self):
@@ -62,24 +131,18 @@ class Window(QtWidgets.QWidget):
         self.total_label.setText(f'current active thread: {threading.activeCount()}')
 
     def add_thread(self):
-        index = len(self.thread_list)
-        # Worker 與 Thread 都必須有參照才能執行
-        worker = Worker()
-        self.worker_list.append(worker)
-        self.thread_list.append(QThread())
-
-        self.do_work.connect(worker.do_work)
-        
-        self.thread_list[index].started.connect(self.worker_list[index].run)
-
-        self.worker_list[index].moveToThread(self.thread_list[index])
+        # 超過上限時沿用既有的 thread
+        if not self.pool.grow():
+            print(f'thread pool is full: {self.pool.size}', flush=True)
 
-        self.thread_list[index].start()
-       
+    def closeEvent(self, event):
+        self.pool.shutdown()
+        super().closeEvent(event)
 
 
-app = QtWidgets.QApplication()
-window = Window()
-window.show()
+if __name__ == '__main__':
+    app = QtWidgets.QApplication()
+    window = Window()
+    window.show()
 
-app.exec()
\ No newline at end of file
+    app.exec()
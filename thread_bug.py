@@ -27,11 +27,12 @@ class Window(QWidget):
 
 def log():
     print('123', flush=True)
-app = QApplication()
-window = Window()
+if __name__ == '__main__':
+    app = QApplication()
+    window = Window()
 
-window.show()
+    window.show()
 
-sys.exit(app.exec())
+    sys.exit(app.exec())
 
 
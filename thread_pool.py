@@ -6,6 +6,8 @@ import threading
 import time
 import random
 
+from task_pool import TaskPool, PoolGovernor
+
 # Runnable 沒辦法靠 slot 接收其他訊號?
 # Slot 不管在 QRunnable 或者 QObject 都會變成在 MainThread 執行
 
@@ -43,6 +45,12 @@ class Worker(QRunnable):
         self.signal.finished.emit()
 
 
+def work():
+    print(current_thread() + 'task start', flush=True)
+    time.sleep(random.randint(1, 3))
+    return current_thread()
+
+
 class Window(QtWidgets.QWidget):
     do_event = Signal()
     def __init__(self):
@@ -57,12 +65,16 @@ class Window(QtWidgets.QWidget):
         event_button = QtWidgets.QPushButton('Random Event')
         event_button.released.connect(self.random_event)
 
+        task_button = QtWidgets.QPushButton('Submit Task')
+        task_button.released.connect(self.submit_task)
+
         self.total_label = QtWidgets.QLabel(
             f'current active thread: {threading.activeCount()}')
         vbox.addWidget(self.main_thread_label)
         vbox.addWidget(button)
         vbox.addWidget(self.total_label)
         vbox.addWidget(event_button)
+        vbox.addWidget(task_button)
 
         self.setLayout(vbox)
 
@@ -77,7 +89,10 @@ class Window(QtWidgets.QWidget):
         self.do_event.connect(self.worker.do_event)
         QThreadPool.globalInstance().start(self.worker)
 
-        QThreadPool.globalInstance().setExpiryTimeout(1000)
+        # 不需要自己寫 QRunnable, 結果會批次回到 main thread
+        self.task_pool = TaskPool()
+        # 依排隊數量調整執行緒數量與 expiryTimeout, 取代固定的 setExpiryTimeout(1000)
+        self.governor = PoolGovernor(self.task_pool)
     def log(self):
         print('123', flush=True)
 
@@ -88,6 +103,14 @@ class Window(QtWidgets.QWidget):
         # print(f'timer thread: {threading.current_thread().getName()} {threading.get_ident()}', flush=True)
         self.total_label.setText(f'current active thread: {threading.activeCount()}')
 
+    def submit_task(self):
+        future = self.task_pool.submit(work, priority=random.randint(0, 3))
+        future = self.task_pool.then(future, lambda name: name + 'continuation')
+        self.task_pool.on_done(future, self.task_done)
+
+    def task_done(self, future):
+        print(current_thread() + f'task done: {future.result()}', flush=True)
+
     def add_thread(self):
         worker = Worker()
         worker.signal.finished.connect(self.log)
@@ -95,8 +118,10 @@ class Window(QtWidgets.QWidget):
         QThreadPool.globalInstance().start(worker)
 
 
-app = QtWidgets.QApplication()
-window = Window()
-window.show()
+if __name__ == '__main__':
+    app = QtWidgets.QApplication()
+    window = Window()
+    window.show()
+
+    app.exec()
 
-app.exec()
@@ -1,98 +1,28 @@
 import sys
-import serial
-import queue
-import time
-import random
-from enum import IntEnum
 import threading
 
 
-from PySide6 import QtWidgets, QtCore, QtSerialPort
+from PySide6 import QtWidgets, QtCore
 from ui_main import Ui_MainWindow
+from log_model import LogModel
+from port_discovery import PortDiscovery, qt_ports, apply_port_changes
+from coalesce import BatchCoalescer, LatestValueCoalescer
+from command import commands
+from flow_source import FileFlowSource
+from checkpoint import CHECKPOINT_SUFFIX
+from engine import FlowWorker, CommandWorker
 
 
-class CommandLevelEnum(IntEnum):
-    EMERGENCY = 1
-    STATUS = 2
-    NORMAL = 3
-
-
-class FlowWorker(QtCore.QObject):
-    send_log = QtCore.Signal(str)
-    send_command = QtCore.Signal(str)
-    send_percentange = QtCore.Signal(int)
-
-    command_list = []
-    current_line = 0
-    current_command = ''
-
-    def set_command_list(self, command_list: list):
-        self.send_log.emit('set command list')
-        self.command_list = command_list
-
-    def do_terminate(self):
-        self.command_list = []
-        self.current_line = 0
-        self.current_command = ''
-
-    def process_response(self, response: bytes):
-        self.send_log.emit(threading.current_thread().name + str(threading.current_thread().ident))
-        compare = response == b'FlowDone\r\n'
-        if compare:
-            self.current_line += 1
-            percentage = self.current_line / len(self.command_list) * 100
-            self.send_percentange.emit(int(percentage))
-            if self.current_line < len(self.command_list):
-                self.send_log.emit('next')
-                self.start_flow()
-
-
-    def start_flow(self):
-        command = self.command_list[self.current_line]
-        self.current_command = command
-        self.send_command.emit(command)
-
-
-
-class CommandWorker(QtCore.QObject):
-    send_log = QtCore.Signal(str)
-    receive_response = QtCore.Signal(bytes)
-
-    serial = None
-    running_flow = False
-
-    def open_uart(self, port: str):
-        self.send_log.emit(str(threading.current_thread().ident))
-        self.serial = QtSerialPort.QSerialPort()
-        self.serial.setPortName(port)
-        self.serial.setBaudRate(115200)
-        result = self.serial.open(QtCore.QIODevice.ReadWrite)
-        self.send_log.emit(f'uart open: {result}')
-        self.serial.readyRead.connect(self.read_response)
-
-    @QtCore.Slot()
-    def read_response(self):
-        if self.serial and self.serial.isOpen() and self.serial.canReadLine():
-            response = self.serial.readLine()
-            # 韌體短時間回傳多筆會沒讀乾淨
-            if len(response) > 0:
-                self.receive_response.emit(response)
-                self.send_log.emit(f'response: {response}')
-                self.read_response()
-
-    @QtCore.Slot(str)
-    def send_command(self, command: str):
-        if self.serial and self.serial.isOpen():
-            formatted_command = f'{command}\r\n'.encode('utf8')
-            self.serial.write(formatted_command)
-            self.send_log.emit(f'sending: {formatted_command}')
-        else:
-            self.send_log.emit('no serail port')
+SIGNAL_INTERVAL = 50
+'''
+worker 的 log 與進度合併後送到 GUI 的間隔 (ms)
+'''
 
 
 class MainController(QtWidgets.QMainWindow):
 
     send_command = QtCore.Signal(str)
+    send_encoded_command = QtCore.Signal(bytes)
     open_uart_connection = QtCore.Signal(str)
     send_terminate = QtCore.Signal()
     send_continue = QtCore.Signal()
@@ -104,9 +34,17 @@ class MainController(QtWidgets.QMainWindow):
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
-        self.get_com_ports()
+        self.log_model = LogModel(parent=self)
+        self.ui.log_list.setModel(self.log_model)
+        self.ui.clear_button.released.connect(self.log_model.clear)
+
+        # 在背景執行緒列舉 port, 只把變動套用到 ports_combobox
+        self.com_ports = []
+        self.port_discovery = PortDiscovery(qt_ports)
+        self.port_discovery.ports_changed.connect(self.update_com_ports)
+        self.port_discovery.start_thread()
 
-        self.ui.refresh_comports_button.released.connect(self.get_com_ports)
+        self.ui.refresh_comports_button.released.connect(self.port_discovery.refresh)
         self.ui.open_comports_button.released.connect(self.open_uart)
 
         # 正常執行
@@ -125,10 +63,17 @@ class MainController(QtWidgets.QMainWindow):
         self.worker.moveToThread(self.worker_thread)
         self.worker_thread.start()
 
-        self.worker.send_log.connect(self.write_log)
+        # worker 的 log 與進度先在 worker 執行緒累積, 每 SIGNAL_INTERVAL 才送到 GUI 一次
+        self.log_coalescer = BatchCoalescer(SIGNAL_INTERVAL, self)
+        self.log_coalescer.delivered.connect(self.write_logs)
+        self.progress_coalescer = LatestValueCoalescer(SIGNAL_INTERVAL, self)
+        self.progress_coalescer.delivered.connect(self.update_progress_bar)
+
+        self.log_coalescer.connect_source(self.worker.send_log)
 
         self.open_uart_connection.connect(self.worker.open_uart)
         self.send_command.connect(self.worker.send_command)
+        self.send_encoded_command.connect(self.worker.write_command)
 
         # Flow
         self.flow_thread = QtCore.QThread()
@@ -136,10 +81,10 @@ class MainController(QtWidgets.QMainWindow):
         self.flow_worker.moveToThread(self.flow_thread)
 
         self.flow_thread.started.connect(self.flow_worker.start_flow)
-        self.flow_worker.send_log.connect(self.write_log)
+        self.log_coalescer.connect_source(self.flow_worker.send_log)
         self.flow_worker.send_command.connect(self.worker.send_command)
-        self.flow_worker.send_percentange.connect(self.update_progress_bar)
-        self.worker.receive_response.connect(self.flow_worker.process_response)
+        self.progress_coalescer.connect_source(self.flow_worker.send_percentange)
+        self.worker.receive_responses.connect(self.flow_worker.process_responses)
 
         self.ui.flow_progress_bar.setValue(0)
 
@@ -148,21 +93,20 @@ class MainController(QtWidgets.QMainWindow):
         self.ui.flow_progress_bar.setValue(percentage)
 
     def send_continue_command(self):
-        self.send_command.emit('suspend[0]')
+        self.send_encoded_command.emit(commands['suspend'].encode(0))
 
     def send_suspend_command(self):
-        self.send_command.emit('suspend[1]')
+        self.send_encoded_command.emit(commands['suspend'].encode(1))
 
     def send_terminate_command(self):
-        self.send_command.emit('suspend[2]')
+        self.send_encoded_command.emit(commands['suspend'].encode(2))
 
     def send_move_command(self):
         # command = 'MoveStnX	20	x	x	x	x	x	x	x	x	x	x	x	x	x	x	x'
-        command = 'MoveStnX\t20\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx\tx'
-        self.send_command.emit(command)
+        self.send_encoded_command.emit(commands['MoveStnX'].encode(20))
 
     def send_home_command(self):
-        self.send_command.emit('home')
+        self.send_encoded_command.emit(commands['home'].encode())
 
     def open_uart(self):
         self.write_log(str(threading.current_thread().ident))
@@ -170,7 +114,10 @@ class MainController(QtWidgets.QMainWindow):
         self.open_uart_connection.emit(port)
 
     def write_log(self, message: str):
-        self.ui.log_list.addItem(message)
+        self.log_model.append(message)
+
+    def write_logs(self, messages: list):
+        self.log_model.extend(messages)
 
     def start_flow(self):
         count = self.ui.command_list.count()
@@ -187,15 +134,42 @@ class MainController(QtWidgets.QMainWindow):
         self.flow_worker.set_command_list(command_list)
         self.flow_thread.start()
 
-    def get_com_ports(self):
-        self.ui.ports_combobox.clear()
-        self.com_ports = [port.portName()
-                          for port in QtSerialPort.QSerialPortInfo().availablePorts()]
-        self.ui.ports_combobox.addItems(self.com_ports)
+    def start_flow_file(self, path: str, resume: bool = False):
+        '''
+        直接由檔案逐行執行腳本, 不載入 command_list
+        每完成一步寫入 path + CHECKPOINT_SUFFIX
+        '''
+        self.flow_thread.quit()
+        self.flow_thread.wait()
+
+        self.flow_worker.do_terminate()
+        self.flow_worker.set_command_source(FileFlowSource(path))
+        self.flow_worker.set_checkpoint(path + CHECKPOINT_SUFFIX, resume)
+        self.flow_thread.start()
+
+    def resume_flow_file(self, path: str):
+        '''
+        由 checkpoint 最後完成的步驟繼續執行
+        '''
+        self.start_flow_file(path, resume=True)
+
+    def get_latency_report(self, name: str = None):
+        '''
+        各指令在傳輸與韌體所花的時間分布 (ns)
+        '''
+        return self.flow_worker.tracer.report(name)
+
+    def update_com_ports(self, added: list, removed: list):
+        apply_port_changes(self.ui.ports_combobox, added, removed)
+        self.com_ports = self.port_discovery.ports()
+
+    def closeEvent(self, event):
+        # 結束 discovery 執行緒並關閉 inotify
+        self.port_discovery.stop()
+        super().closeEvent(event)
 
 
 if __name__ == '__main__':
-    import sys
     app = QtWidgets.QApplication(sys.argv)
 
     window = MainController()
@@ -0,0 +1,189 @@
+import time
+import threading
+from array import array
+from enum import IntEnum
+
+
+class TraceStage(IntEnum):
+    ENQUEUE = 0
+    DEQUEUE = 1
+    WRITE = 2
+    ACK = 3
+    FLOW_DONE = 4
+
+
+SEGMENTS = {
+    'queue': (TraceStage.ENQUEUE, TraceStage.DEQUEUE),
+    'dispatch': (TraceStage.DEQUEUE, TraceStage.WRITE),
+    'wire': (TraceStage.WRITE, TraceStage.ACK),
+    'firmware': (TraceStage.ACK, TraceStage.FLOW_DONE),
+    'total': (TraceStage.ENQUEUE, TraceStage.FLOW_DONE),
+}
+'''
+每個區段的起訖階段, 用來區分時間花在排隊, 傳輸或韌體
+'''
+
+
+class LatencyHistogram(object):
+    '''
+    HDR 風格的對數線性 histogram, 單位為 ns
+    每個 2 的次方區間再切成 SUB_BUCKETS / 2 格, 相對誤差約 1 / SUB_BUCKETS
+    '''
+    SUB_BITS = 5
+    SUB_BUCKETS = 1 << SUB_BITS
+    HALF_BUCKETS = SUB_BUCKETS >> 1
+
+    def __init__(self):
+        self.counts = array('q', bytes(8 * (self.SUB_BUCKETS + 64 * self.HALF_BUCKETS)))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def index(self, value: int):
+        if value < self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - self.SUB_BITS
+        return self.SUB_BUCKETS + (shift - 1) * self.HALF_BUCKETS + (value >> shift) - self.HALF_BUCKETS
+
+    def value(self, index: int):
+        '''
+        bucket 的下界
+        '''
+        if index < self.SUB_BUCKETS:
+            return index
+        shift, offset = divmod(index - self.SUB_BUCKETS, self.HALF_BUCKETS)
+        return (offset + self.HALF_BUCKETS) << (shift + 1)
+
+    def record(self, value: int):
+        value = max(0, value)
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def percentile(self, q: float):
+        if self.count == 0:
+            return 0
+        target = max(1, int(self.count * q / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                # bucket 的下界可能小於實際的最小值
+                return min(max(self.value(index), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'min': self.min or 0,
+            'mean': self.total // self.count if self.count else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class CommandTracer(object):
+    '''
+    紀錄每個指令從 set_command 到 FlowDone 各階段的時間
+    時間戳記以 perf_counter_ns 寫入預先配置的 array, 指令完成時彙整到各指令名稱的 histogram
+    超過 capacity 個指令同時未完成時, 較早的指令的 slot 會被覆寫, 其 stamp 與 finish 會被捨棄
+    '''
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.stages = len(TraceStage)
+        self.timestamps = array('q', bytes(8 * capacity * self.stages))
+        self.names = [None] * capacity
+        # 每個 slot 目前屬於哪個 trace_id
+        self.owners = array('q', [-1]) * capacity
+        # slot 被覆寫而捨棄的 stamp 與 finish
+        self.dropped = 0
+        self.histograms = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def command_name(command):
+        if isinstance(command, (bytes, bytearray)):
+            command = command.decode('utf8', 'replace')
+        return command.strip().split('\t', 1)[0]
+
+    def begin(self, command) -> int:
+        with self.lock:
+            trace_id = self.next_id
+            self.next_id += 1
+        index = trace_id % self.capacity
+        slot = index * self.stages
+        self.owners[index] = trace_id
+        for stage in range(self.stages):
+            self.timestamps[slot + stage] = 0
+        self.names[index] = self.command_name(command)
+        self.timestamps[slot] = time.perf_counter_ns()
+        return trace_id
+
+    def owns(self, trace_id: int):
+        '''
+        slot 是否仍屬於 trace_id, 已被後來的指令覆寫時記錄為 dropped
+        '''
+        if self.owners[trace_id % self.capacity] == trace_id:
+            return True
+        self.dropped += 1
+        return False
+
+    def stamp(self, trace_id: int, stage: TraceStage):
+        if trace_id is None or not self.owns(trace_id):
+            return
+        self.timestamps[(trace_id % self.capacity) * self.stages + stage] = time.perf_counter_ns()
+
+    def elapsed(self, trace_id: int, start: TraceStage, end: TraceStage):
+        '''
+        兩個階段之間的時間 (ns)
+        '''
+        slot = (trace_id % self.capacity) * self.stages
+        return self.timestamps[slot + end] - self.timestamps[slot + start]
+
+    def finish(self, trace_id: int):
+        '''
+        紀錄 FlowDone 並將各區段的時間加入 histogram
+        '''
+        if trace_id is None or not self.owns(trace_id):
+            return
+        index = trace_id % self.capacity
+        slot = index * self.stages
+        self.timestamps[slot + TraceStage.FLOW_DONE] = time.perf_counter_ns()
+        name = self.names[index]
+        with self.lock:
+            histograms = self.histograms.setdefault(name, {})
+            for segment, (start, end) in SEGMENTS.items():
+                start_time = self.timestamps[slot + start]
+                end_time = self.timestamps[slot + end]
+                # 沒有經過的階段 (例如沒有 ack) 不列入
+                if start_time == 0 or end_time == 0:
+                    continue
+                histogram = histograms.get(segment)
+                if histogram is None:
+                    histogram = histograms[segment] = LatencyHistogram()
+                histogram.record(end_time - start_time)
+
+    def report(self, name: str = None):
+        '''
+        回傳 {指令名稱: {區段: summary}}, 單位為 ns
+        '''
+        with self.lock:
+            names = [name] if name is not None else list(self.histograms)
+            return {
+                name: {
+                    segment: histogram.summary()
+                    for segment, histogram in self.histograms.get(name, {}).items()
+                }
+                for name in names
+            }
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
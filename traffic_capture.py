@@ -0,0 +1,381 @@
+import os
+import sys
+import mmap
+import time
+import select
+import struct
+import argparse
+import threading
+
+
+MAGIC = b'QTCAP01\0'
+HEADER = struct.Struct('<8sQ')
+'''
+magic, 開始錄製時的 time.time_ns(), 用來對照現場的 log
+'''
+RECORD = struct.Struct('<QBI')
+'''
+time.monotonic_ns(), 方向, 資料長度, 後面接著資料本身
+'''
+
+WRITE = 1
+'''
+主機寫到 serial 的資料
+'''
+READ = 2
+'''
+主機從 serial 讀到的資料
+'''
+
+DIRECTIONS = {WRITE: 'write', READ: 'read'}
+
+
+class TrafficRecorder(object):
+    '''
+    append-only 紀錄 serial 的每一次讀寫
+    可以由多個執行緒呼叫, 每 flush_every 筆或 flush_interval 秒才 flush 一次, 不會 fsync
+    程式被中止時最多遺失最後一次 flush 之後的紀錄, 最後一筆可能不完整, 讀取時會略過
+    '''
+
+    def __init__(self, path: str, buffering: int = 64 * 1024,
+                 flush_every: int = 256, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb', buffering=buffering)
+        self.file.write(HEADER.pack(MAGIC, time.time_ns()))
+        self.count = 0
+
+    def record(self, direction: int, data):
+        if len(data) == 0:
+            return
+        timestamp = time.monotonic_ns()
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(RECORD.pack(timestamp, direction, len(data)))
+            self.file.write(data)
+            self.count += 1
+            self.pending += 1
+            # 以 monotonic_ns 的時間判斷, 不另外讀取時鐘
+            if self.pending >= self.flush_every or \
+                    timestamp / 1e9 - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.pending = 0
+                self.last_flush = timestamp / 1e9
+
+    def record_write(self, data):
+        self.record(WRITE, data)
+
+    def record_read(self, data):
+        self.record(READ, data)
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+                self.pending = 0
+                self.last_flush = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+class TrafficCapture(object):
+    '''
+    以 mmap 讀取 TrafficRecorder 的檔案, 資料以 memoryview 回傳, 不複製
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.close()
+            raise ValueError(f'not a traffic capture: {path}')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, self.started = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'not a traffic capture: {path}')
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self):
+        '''
+        回傳 (timestamp, direction, data)
+        '''
+        offset = HEADER.size
+        size = len(self.map)
+        while offset + RECORD.size <= size:
+            timestamp, direction, length = RECORD.unpack_from(self.map, offset)
+            offset += RECORD.size
+            if offset + length > size:
+                # 錄製中斷時只寫了一半
+                return
+            yield timestamp, direction, self.view[offset:offset + length]
+            offset += length
+
+    def summary(self):
+        count = {WRITE: 0, READ: 0}
+        size = {WRITE: 0, READ: 0}
+        first = last = None
+        for timestamp, direction, data in self.records():
+            count[direction] = count.get(direction, 0) + 1
+            size[direction] = size.get(direction, 0) + len(data)
+            if first is None:
+                first = timestamp
+            last = timestamp
+        return {
+            'writes': count[WRITE],
+            'reads': count[READ],
+            'write_bytes': size[WRITE],
+            'read_bytes': size[READ],
+            'duration': 0.0 if first is None else (last - first) / 1e9,
+        }
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # 呼叫端仍持有 records() 的 memoryview, 由 GC 回收 mmap
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RecordingSerial(object):
+    '''
+    包裝 pyserial 的 Serial, 讀寫時同時寫入 recorder
+    其他屬性 (in_waiting, fileno, is_open...) 直接轉給原本的 Serial
+    '''
+
+    def __init__(self, serial, recorder: TrafficRecorder):
+        self.serial = serial
+        self.recorder = recorder
+
+    def write(self, data):
+        self.recorder.record(WRITE, data)
+        return self.serial.write(data)
+
+    def read(self, size: int = 1):
+        data = self.serial.read(size)
+        self.recorder.record(READ, data)
+        return data
+
+    def readinto(self, buffer):
+        size = self.serial.readinto(buffer)
+        if size:
+            self.recorder.record(READ, buffer[:size])
+        return size
+
+    def __getattr__(self, name):
+        return getattr(self.serial, name)
+
+
+class ReplayDevice(object):
+    '''
+    以 pseudo-terminal 重播錄製的資料, port 可以直接傳給任何 CommandWorker 的 open_uart
+    每筆 READ 依原本的間隔除以 speed 送出, speed 為 0 時不等待
+    每筆 WRITE 等待 worker 寫出相同長度的資料並比對, 不一致時記錄 mismatches
+    '''
+
+    def __init__(self, path: str, speed: float = 1.0, write_timeout: float = 5.0):
+        self.capture = TrafficCapture(path)
+        self.speed = speed
+        # 等待 worker 寫出資料的時間上限 (秒)
+        self.write_timeout = write_timeout
+
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.thread = None
+        self.stop_reader, self.stop_writer = os.pipe()
+        self.running = False
+        self.finished = threading.Event()
+
+        self.replayed = 0
+        self.mismatches = 0
+        self.timeouts = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        # tty 只有 posix 有, 錄製端 (Windows) 不需要
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.replay, name='traffic-replay', daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        os.write(self.stop_writer, b'\0')
+        self.thread.join()
+        os.close(self.master)
+        if self.slave is not None:
+            os.close(self.slave)
+        os.close(self.stop_reader)
+        os.close(self.stop_writer)
+        self.capture.close()
+
+    def wait(self, timeout: float = None):
+        return self.finished.wait(timeout)
+
+    def wait_hangup(self, timeout: float = None):
+        '''
+        重播結束後等待 worker 關閉 port (master 收到 HUP), 逾時回傳 False
+        自己持有的 slave 必須先關閉, 否則 master 不會收到 HUP
+        '''
+        if self.slave is not None:
+            os.close(self.slave)
+            self.slave = None
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is None:
+                events = poller.poll()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                events = poller.poll(remaining * 1000)
+            for fd, event in events:
+                if event & (select.POLLHUP | select.POLLERR):
+                    return True
+                try:
+                    # 重播結束後 worker 寫出的資料不再比對, 避免 pty 的緩衝區滿了卡住 worker
+                    os.read(self.master, 4096)
+                except OSError:
+                    # Linux 在 slave 全部關閉後讀取 master 會得到 EIO
+                    return True
+
+    def sleep(self, seconds: float):
+        '''
+        回傳 False 代表已被 stop 中斷
+        '''
+        if seconds <= 0:
+            return self.running
+        readable, _, _ = select.select([self.stop_reader], [], [], seconds)
+        return not readable
+
+    def expect(self, data, pending: bytearray):
+        '''
+        讀取 worker 寫出的資料直到長度與錄製的 WRITE 相同
+        '''
+        deadline = time.monotonic() + self.write_timeout
+        while len(pending) < len(data):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.timeouts += 1
+                return False
+            readable, _, _ = select.select([self.master, self.stop_reader], [], [], remaining)
+            if self.stop_reader in readable:
+                return False
+            if self.master in readable:
+                pending += os.read(self.master, 4096)
+
+        if pending[:len(data)] != data:
+            self.mismatches += 1
+        del pending[:len(data)]
+        return True
+
+    def replay(self):
+        start = time.perf_counter()
+        previous = None
+        # worker 寫出但尚未比對的資料
+        pending = bytearray()
+        try:
+            for timestamp, direction, data in self.capture.records():
+                if not self.running:
+                    return
+                if direction == WRITE:
+                    if not self.expect(data, pending) and not self.running:
+                        return
+                elif direction == READ:
+                    if previous is not None and self.speed > 0:
+                        if not self.sleep((timestamp - previous) / 1e9 / self.speed):
+                            return
+                    os.write(self.master, data)
+                previous = timestamp
+                self.replayed += 1
+        finally:
+            self.elapsed = time.perf_counter() - start
+            self.finished.set()
+
+    def stats(self):
+        return {
+            'replayed': self.replayed,
+            'mismatches': self.mismatches,
+            'timeouts': self.timeouts,
+            'elapsed': self.elapsed,
+        }
+
+
+def dump(path: str, limit: int = 0):
+    with TrafficCapture(path) as capture:
+        first = None
+        for index, (timestamp, direction, data) in enumerate(capture.records()):
+            if limit and index >= limit:
+                break
+            if first is None:
+                first = timestamp
+            print(f'{(timestamp - first) / 1e6:12.3f} ms {DIRECTIONS.get(direction, direction):>5} {bytes(data)!r}')
+        print(capture.summary())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='inspect or replay a serial traffic capture')
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    dump_parser = commands.add_parser('dump')
+    dump_parser.add_argument('capture')
+    dump_parser.add_argument('--limit', type=int, default=0)
+
+    replay_parser = commands.add_parser('replay')
+    replay_parser.add_argument('capture')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='0 replays as fast as possible')
+    replay_parser.add_argument('--write-timeout', type=float, default=5.0)
+    replay_parser.add_argument('--grace', type=float, default=5.0,
+                               help='seconds to keep the port open after the last record, 0 waits until the client closes it')
+    args = parser.parse_args()
+
+    if args.action == 'dump':
+        dump(args.capture, args.limit)
+        sys.exit(0)
+
+    with ReplayDevice(args.capture, args.speed, args.write_timeout) as device:
+        print(device.port, flush=True)
+        try:
+            device.wait()
+            # 最後一筆之後 worker 可能還在讀取, 等它關閉 port 再關閉 pty
+            device.wait_hangup(args.grace or None)
+        except KeyboardInterrupt:
+            pass
+        print(device.stats(), flush=True)
+    sys.exit(0)
@@ -15,10 +15,10 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QApplication, QComboBox, QHBoxLayout, QListWidget,
-    QListWidgetItem, QMainWindow, QMenuBar, QProgressBar,
-    QPushButton, QSizePolicy, QStatusBar, QVBoxLayout,
-    QWidget)
+from PySide6.QtWidgets import (QApplication, QComboBox, QHBoxLayout, QListView,
+    QListWidget, QListWidgetItem, QMainWindow, QMenuBar,
+    QProgressBar, QPushButton, QSizePolicy, QStatusBar,
+    QVBoxLayout, QWidget)
 
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
@@ -57,8 +57,9 @@ class Ui_MainWindow(object):
 
         self.verticalLayout.addWidget(self.flow_progress_bar)
 
-        self.log_list = QListWidget(self.layoutWidget)
+        self.log_list = QListView(self.layoutWidget)
         self.log_list.setObjectName(u"log_list")
+        self.log_list.setUniformItemSizes(True)
 
         self.verticalLayout.addWidget(self.log_list)
 
@@ -149,7 +150,6 @@ class Ui_MainWindow(object):
         MainWindow.setStatusBar(self.statusbar)
 
         self.retranslateUi(MainWindow)
-        self.clear_button.released.connect(self.log_list.clear)
 
         QMetaObject.connectSlotsByName(MainWindow)
     # setupUi